@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from cache import ParseCache
+from callgraph import CallGraph
+from main import create_dataset
+from match import build_mapping, create_map
+from output import ShardedWriter
+from pairwise import find_vulnerable_function, normalize_function_body
+from similarity import find_similar
+from split import Chunker
+from synthetic import generate_repo
+
+# Offline benchmarks of the hot paths, on synthetic repos of a few sizes, and of start up.
+# usage: python bench.py [--scales startup,small,medium] [--repeat 3] [--results bench_results.jsonl]
+#
+# Every run is appended to the results file. Each benchmark's best time is compared with
+# the last run at the same scale, and anything slower than --tolerance is reported as a
+# regression (and fails the run with --strict).
+
+SCALES = {
+    "small": {"files": 20, "functions_per_file": 10, "fan_out": 3, "near_duplicates": 10},
+    "medium": {"files": 100, "functions_per_file": 20, "fan_out": 4, "near_duplicates": 20},
+    "large": {"files": 400, "functions_per_file": 25, "fan_out": 5, "near_duplicates": 50},
+}
+
+# how many near duplicate pairs are looked up per matching benchmark
+TARGETS = 10
+
+# each in a fresh interpreter, what a new run or pool worker pays before it parses anything
+STARTUP = {
+    "interpreter": "pass",
+    "import_split": "import split",
+    "first_parse_c": "import split; split.Chunker(verbose=False).extract_from_content('a.c', b'int f(void) { return g(); }')",
+    "all_grammars": "import parsers; [parsers.registry.extractor(language) for language in set(parsers.LANGUAGES.values())]",
+}
+
+
+def timed(function, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": statistics.median(times)}, result
+
+
+def run_scale(name, params, repeat, workdir):
+    repo_path = os.path.join(workdir, name, "repo")
+    manifest = generate_repo(repo_path, **params)
+    targets = [original for original, _ in manifest["duplicates"][:TARGETS]]
+    results = dict()
+
+    chunker = Chunker()
+    results["parse"], data = timed(lambda: chunker.read_and_parse_documents_with_callees(repo_path), repeat)
+
+    cached_chunker = Chunker(cache=ParseCache())
+    cached_chunker.read_and_parse_documents_with_callees(repo_path)
+    results["parse_cached"], _ = timed(lambda: cached_chunker.read_and_parse_documents_with_callees(repo_path), repeat)
+
+    # the targets are in data, so each must at least find itself (its copy too, mostly)
+    results["match_index"], found = timed(lambda: [find_vulnerable_function(data, body) for _, body in targets], repeat)
+    if not all(found):
+        raise RuntimeError(f"{name}: targets not found, {[len(candidates) for candidates in found]}")
+    results["match_stream"], _ = timed(lambda: [list(find_similar(iter(data), body, normalize_function_body)) for _, body in targets], repeat)
+
+    def call_graph():
+        graph = CallGraph.from_records(data)
+        mapping = graph.mapping()
+        for function_name, _ in targets:
+            graph.caller_records(function_name)
+        return mapping
+    results["call_graph"], mapping = timed(call_graph, repeat)
+
+    benchmark_path = os.path.join(workdir, name, "benchmark", "{shard}.jsonl")
+    def write_jsonl():
+        # create_dataset prints every match it writes
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull), ShardedWriter(benchmark_path) as writer:
+            create_dataset(data, "CWE-0", "0" * 40, targets[0][1], writer)
+    results["write_jsonl"], _ = timed(write_jsonl, repeat)
+    results["create_map"], _ = timed(lambda: create_map(benchmark_path.format(shard="CWE-0")), repeat)
+    results["build_mapping"], _ = timed(lambda: build_mapping(benchmark_path.format(shard="CWE-0")), repeat)
+
+    sizes = {
+        "files": params["files"],
+        "functions": len(data),
+        "bytes": sum(len(entry[3]) for entry in data),
+        "names": len(mapping),
+    }
+    return sizes, results
+
+
+def run_startup(repeat):
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = dict()
+    for name, code in STARTUP.items():
+        results[name], _ = timed(lambda: subprocess.run([sys.executable, "-c", code], cwd=here, check=True, capture_output=True), repeat)
+    return results
+
+
+def git_commit():
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def previous_runs(results_path):
+    # last recorded run per scale
+    runs = dict()
+    if not os.path.exists(results_path):
+        return runs
+    with open(results_path, 'r') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            runs[(record["scale"], json.dumps(record["params"], sort_keys=True))] = record
+    return runs
+
+
+def compare(previous, results, tolerance):
+    regressions = []
+    for benchmark, timing in results.items():
+        before = previous["results"].get(benchmark) if previous else None
+        line = f"  {benchmark:<14} {timing['min'] * 1000:10.1f} ms (median {timing['median'] * 1000:.1f} ms)"
+        if before:
+            change = timing["min"] / before["min"] - 1 if before["min"] else 0.0
+            line += f"  {change:+.1%} vs {previous.get('commit') or 'previous run'}"
+            if change > tolerance:
+                line += "  REGRESSION"
+                regressions.append(benchmark)
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks on synthetic C/C++ repos")
+    parser.add_argument("--scales", default="startup,small,medium", help=f"comma separated, out of startup, {', '.join(SCALES)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--results", default="bench_results.jsonl")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="slowdown reported as a regression")
+    parser.add_argument("--strict", action="store_true", help="exit with 1 on a regression")
+    args = parser.parse_args()
+
+    previous = previous_runs(args.results)
+    commit = git_commit()
+    regressions = []
+    with tempfile.TemporaryDirectory() as workdir, open(args.results, 'a') as results_file:
+        for name in args.scales.split(","):
+            if name == "startup":
+                params = {}
+                sizes = {}
+                results = run_startup(args.repeat)
+                print("startup: fresh interpreters")
+            else:
+                params = SCALES[name]
+                sizes, results = run_scale(name, params, args.repeat, workdir)
+                print(f"{name}: {sizes['files']} files, {sizes['functions']} functions, {sizes['bytes']} bytes")
+
+            key = (name, json.dumps(params, sort_keys=True))
+            regressions.extend(f"{name}/{benchmark}" for benchmark in compare(previous.get(key), results, args.tolerance))
+            record = {
+                "time": time.time(),
+                "commit": commit,
+                "python": platform.python_version(),
+                "scale": name,
+                "params": params,
+                "sizes": sizes,
+                "repeat": args.repeat,
+                "results": results,
+            }
+            results_file.write(json.dumps(record) + "\n")
+
+    if regressions:
+        print("regressions:", ", ".join(regressions))
+    sys.exit(1 if regressions and args.strict else 0)
+
+
+if __name__ == '__main__':
+    main()
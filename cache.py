@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+
+def blob_id(content : bytes) -> str:
+    # same id git gives the file's blob, so it can be compared with `git ls-tree` output
+    header = f"blob {len(content)}\0".encode()
+    return hashlib.sha1(header + content).hexdigest()
+
+
+# Parse results keyed by file content, so unchanged files are never re-parsed.
+# Entries live in memory (LRU, bounded by max_memory_bytes) and, if cache_dir is
+# given, on disk too, where the oldest entries go once it passes max_disk_bytes.
+class ParseCache:
+    def __init__(self, cache_dir : str = None, max_memory_bytes : int = 512 * 1024 * 1024, max_disk_bytes : int = 4 * 1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self.__memory = OrderedDict()
+        self.__memory_bytes = 0
+        self.__disk_bytes = 0
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.__disk_bytes = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.is_file())
+
+    def key(self, ext : str, content : bytes) -> str:
+        # the parser depends on the extension, so the same bytes under .c and .cpp differ
+        return self.blob_key(ext, blob_id(content))
+
+    def blob_key(self, ext : str, blob : str) -> str:
+        # the same key from a blob id git already knows, without reading the content
+        return f"{ext.lstrip('.')}-{blob}"
+
+    def get(self, key : str):
+        chunks = self.__memory.get(key)
+        if chunks is not None:
+            self.__memory.move_to_end(key)
+            self.hits += 1
+            return chunks
+
+        chunks = self.__read_disk(key)
+        if chunks is not None:
+            self.__remember(key, chunks)
+            self.hits += 1
+            return chunks
+
+        self.misses += 1
+        return None
+
+    def put(self, key : str, chunks : list) -> None:
+        self.__remember(key, chunks)
+        self.__write_disk(key, chunks)
+
+    def clear(self) -> None:
+        self.__memory.clear()
+        self.__memory_bytes = 0
+
+    @staticmethod
+    def __size(chunks):
+        return sum(len(signature) + len(body) + sum(len(callee) for callee in callees) for signature, callees, body in chunks)
+
+    def __remember(self, key, chunks):
+        if key in self.__memory:
+            return
+        self.__memory[key] = chunks
+        self.__memory_bytes += self.__size(chunks)
+
+        while self.__memory_bytes > self.max_memory_bytes and len(self.__memory) > 1:
+            _, evicted = self.__memory.popitem(last=False)
+            self.__memory_bytes -= self.__size(evicted)
+
+    def __disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def __read_disk(self, key):
+        if self.cache_dir is None:
+            return None
+        path = self.__disk_path(key)
+        try:
+            with open(path, 'r') as file:
+                chunks = [tuple(chunk) for chunk in json.load(file)]
+        except (OSError, ValueError):
+            return None
+        # bump the mtime so eviction drops the least recently used entries first
+        os.utime(path)
+        return chunks
+
+    def __write_disk(self, key, chunks):
+        if self.cache_dir is None:
+            return
+        path = self.__disk_path(key)
+        if os.path.exists(path):
+            return
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(chunks, file)
+        os.replace(tmp_path, path)
+        self.__disk_bytes += os.path.getsize(path)
+
+        if self.__disk_bytes > self.max_disk_bytes:
+            self.__evict_disk()
+
+    def __evict_disk(self):
+        entries = sorted(
+            (entry for entry in os.scandir(self.cache_dir) if entry.is_file()),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        self.__disk_bytes = sum(entry.stat().st_size for entry in entries)
+        # drop down to 90% so we don't evict again on the very next write
+        target = self.max_disk_bytes * 0.9
+        for entry in entries:
+            if self.__disk_bytes <= target:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self.__disk_bytes -= size
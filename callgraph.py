@@ -0,0 +1,130 @@
+import json
+from collections import deque
+from records import FunctionTable
+
+
+def get_function_name(function_signature):
+    return function_signature.split('(')[0].strip()
+
+
+# Call graph of one parse, built once and queried in O(1) per name.
+#
+# Functions are keyed by get_function_name(signature). When a name is defined more
+# than once the last definition wins, like the dicts create_map used to build, and
+# callers keep one entry per call, in the same order create_map produced them.
+# Built from a FunctionTable, the graph's records are the table's rows, nothing is copied out.
+class CallGraph:
+    def __init__(self):
+        self.records = []
+        # name -> indices of the records defining it
+        self.definitions = dict()
+        # name -> callees of its last definition
+        self.callees_map = dict()
+        # callee name -> indices of the records calling it, once per record
+        self.calling_records = dict()
+        self.__callers_map = None
+
+    @classmethod
+    def from_records(cls, data):
+        graph = cls()
+        if isinstance(data, FunctionTable):
+            graph.records = data
+            for idx in range(len(data)):
+                graph.__index(idx, data.signatures[idx], data.callees(idx))
+            return graph
+        for entry in data:
+            graph.add(*entry)
+        return graph
+
+    @classmethod
+    def from_jsonl(cls, jsonl_file):
+        # benchmark files written by main.create_dataset
+        graph = cls()
+        with open(jsonl_file, 'r') as file:
+            for line in file:
+                entry = json.loads(line)
+                graph.add(entry.get('file_path'), entry['function_signature'], entry['callees'], entry['function_body'])
+        return graph
+
+    def add(self, file_path, function_signature, callees, function_body):
+        idx = len(self.records)
+        if isinstance(self.records, FunctionTable):
+            self.records.append(file_path, function_signature, callees, function_body)
+        else:
+            self.records.append((file_path, function_signature, callees, function_body))
+        self.__index(idx, function_signature, callees)
+
+    def __index(self, idx, function_signature, callees):
+        function_name = get_function_name(function_signature)
+        self.definitions.setdefault(function_name, []).append(idx)
+        self.callees_map[function_name] = callees
+
+        for callee in dict.fromkeys(callees):
+            self.calling_records.setdefault(callee, []).append(idx)
+        self.__callers_map = None
+
+    @property
+    def callers_map(self):
+        if self.__callers_map is None:
+            callers_map = dict()
+            for key, value in self.callees_map.items():
+                for callee in value:
+                    if callee not in callers_map:
+                        callers_map[callee] = list()
+                    callers_map[callee].append(key)
+            self.__callers_map = callers_map
+        return self.__callers_map
+
+    def definition(self, function_name):
+        # the record a name resolves to, the last one defining it
+        indices = self.definitions.get(function_name)
+        if not indices:
+            return None
+        return self.records[indices[-1]]
+
+    def callees(self, function_name) -> list:
+        return self.callees_map.get(function_name, [])
+
+    def callers(self, function_name) -> list:
+        return self.callers_map.get(function_name, [])
+
+    def caller_records(self, function_name) -> list:
+        return [self.records[idx] for idx in self.calling_records.get(function_name, [])]
+
+    def neighborhood(self, function_name, k : int = 1, direction : str = "both") -> dict:
+        # names within k calls of function_name, mapped to their distance
+        if direction not in ("callers", "callees", "both"):
+            raise ValueError(f"unknown direction: {direction}")
+
+        distances = {function_name: 0}
+        queue = deque([function_name])
+        while queue:
+            name = queue.popleft()
+            if distances[name] == k:
+                continue
+
+            neighbours = []
+            if direction in ("callees", "both"):
+                neighbours.extend(self.callees(name))
+            if direction in ("callers", "both"):
+                neighbours.extend(self.callers(name))
+
+            for neighbour in neighbours:
+                if neighbour not in distances:
+                    distances[neighbour] = distances[name] + 1
+                    queue.append(neighbour)
+
+        del distances[function_name]
+        return distances
+
+    def mapping(self) -> dict:
+        mappings = dict()
+        for file_path, function_signature, callees, function_body in self.records:
+            function_name = get_function_name(function_signature)
+            mappings[function_name] = {
+                'function_signature': function_signature,
+                'function_body': function_body,
+                'callees': self.callees(function_name),
+                'callers': self.callers(function_name)
+            }
+        return mappings
@@ -1,23 +1,204 @@
 import subprocess
 import os 
+import shutil
+import threading
+from metrics import metrics
+from parsers import LANGUAGES
+
+
+def _git(args, cwd=None):
+    # timed per git subcommand, "git clone", "git fetch", ...
+    with metrics.stage(f"git {args[0]}"):
+        return subprocess.run(["git", *args], cwd=cwd, capture_output=True, text=True)
+
 
 class Cloner:
-    def __init__(self, projects_dir : str = "projects"):
+    # blobless leaves file contents on the server until a checkout needs them,
+    # sparse only checks out the files the Chunker parses; both apply to fetch_commit
+    def __init__(self, projects_dir : str = "projects", blobless : bool = False, sparse : bool = False):
         self.path = "repo"
         self.projects_dir = projects_dir
+        self.blobless = blobless
+        self.sparse = sparse
+    
+    def __repo_path(self):
+        return os.path.join(self.projects_dir, self.path)
+    
+    def __run(self, args, what):
+        result = _git(args, cwd=self.__repo_path())
+        if result.returncode != 0:
+            print(f"Couldn't {what} in {self.__repo_path()}:", result.stderr.strip())
+            return False
+        return True
         
-    def clone(self, url : str, path : str = 'repo') -> None:
+    def clone(self, url : str, path : str = 'repo') -> bool:
         self.path = path
-        subprocess.run(["git", "clone", url, os.path.join(self.projects_dir, path)])
+        result = _git(["clone", url, self.__repo_path()])
+        if result.returncode != 0:
+            print("Couldn't clone", url, result.stderr.strip())
+            return False
+        return True
     
-    def checkout_to_vulnerable(self, commit_id : str) -> None:
-        subprocess.run(f"cd {os.path.join(self.projects_dir, self.path)} && git checkout {commit_id}  && git checkout HEAD^", shell=True)
+    def fetch_commit(self, url : str, commit_id : str, path : str = 'repo') -> bool:
+        # just the fix commit and its parent instead of the whole history, 
+        # the checkout_to_* methods work on the result like on a full clone
+        self.path = path
+        os.makedirs(self.__repo_path(), exist_ok=True)
+        if not os.path.isdir(os.path.join(self.__repo_path(), ".git")):
+            if not (self.__run(["init", "--quiet"], "init")
+                    and self.__run(["remote", "add", "origin", url], "add remote")):
+                return False
+        elif not self.__run(["remote", "set-url", "origin", url], "set remote"):
+            # path may hold another project from an earlier call
+            return False
+        
+        if self.sparse:
+            patterns = [f"*{ext}" for ext in LANGUAGES]
+            if not self.__run(["sparse-checkout", "set", "--no-cone", *patterns], "set up sparse checkout"):
+                return False
+        
+        args = ["fetch", "--quiet", "--depth=2"]
+        if self.blobless:
+            args.append("--filter=blob:none")
+        if not self.__run([*args, "origin", commit_id], f"fetch {commit_id}"):
+            return False
+        return True
     
-    def checkout_to_benign(self,  commit_id : str) -> None:
-        subprocess.run(f"cd {os.path.join(self.projects_dir, self.path)} && git checkout {commit_id}", shell=True)
+    def checkout_to_vulnerable(self, commit_id : str) -> bool:
+        return self.__run(["checkout", "--quiet", "--detach", f"{commit_id}^"], f"check out {commit_id}^")
+    
+    def checkout_to_benign(self,  commit_id : str) -> bool:
+        return self.__run(["checkout", "--quiet", "--detach", commit_id], f"check out {commit_id}")
+        
+    def changed_files(self, commit_id : str) -> list:
+        # files touched by the fix, both sides of renames included
+        result = _git(["diff", "--name-only", "--no-renames", f"{commit_id}^", commit_id], cwd=self.__repo_path())
+        if result.returncode != 0:
+            print("Couldn't diff", commit_id, result.stderr.strip())
+            return None
+        return [line for line in result.stdout.splitlines() if line]
         
     def remove_repo(self) -> None:
-        try:            
-            subprocess.run(f"rm -rf {os.path.join(self.projects_dir, self.path)}", shell=True)
-        except Exception as e:
-            print("Repository doesn't exist")
\ No newline at end of file
+        if not os.path.exists(self.__repo_path()):
+            print("Repository doesn't exist")
+            return
+        shutil.rmtree(self.__repo_path())
+
+# Keeps one bare mirror per project and hands out a worktree of it, 
+# so a project is cloned once no matter how many entries it has.
+class RepositoryCache:
+    def __init__(self, mirrors_dir : str = "mirrors", projects_dir : str = "projects"):
+        self.mirrors_dir = mirrors_dir
+        self.projects_dir = projects_dir
+        os.makedirs(mirrors_dir, exist_ok=True)
+        os.makedirs(projects_dir, exist_ok=True)
+        self.__locks = dict()
+        self.__locks_guard = threading.Lock()
+        # worktrees handed back with release_worktree, per project, and how many were ever made
+        self.__released = dict()
+        self.__leased = dict()
+        
+    def lock(self, project : str) -> threading.Lock:
+        # git operations on one mirror have to be serialized when several threads share the cache
+        with self.__locks_guard:
+            return self.__locks.setdefault(project, threading.Lock())
+        
+    def mirror_path(self, project : str) -> str:
+        return os.path.join(self.mirrors_dir, f"{project}.git")
+    
+    def has_commit(self, project : str, commit_id : str) -> bool:
+        return _git(["cat-file", "-e", f"{commit_id}^{{commit}}"], cwd=self.mirror_path(project)).returncode == 0
+    
+    def ensure_mirror(self, project : str, url : str, commit_id : str = None) -> bool:
+        mirror = self.mirror_path(project)
+        if not os.path.isdir(mirror):
+            result = _git(["clone", "--mirror", url, mirror])
+            if result.returncode != 0:
+                print("Couldn't clone", url, result.stderr.strip())
+                return False
+        
+        if commit_id is None or self.has_commit(project, commit_id):
+            return True
+        
+        # only go to the network when the mirror is missing the commit
+        _git(["fetch", "--prune", "origin"], cwd=mirror)
+        if not self.has_commit(project, commit_id):
+            # commits off every branch can still be fetched directly on most hosts
+            _git(["fetch", "origin", commit_id], cwd=mirror)
+        if not self.has_commit(project, commit_id):
+            print("Commit", commit_id, "not found in", url)
+            return False
+        return True
+    
+    def worktree_path(self, project : str) -> str:
+        return os.path.join(self.projects_dir, project)
+    
+    def checkout(self, project : str, url : str, commit_id : str) -> Cloner:
+        # returns a Cloner on the project's worktree, or None if the commit can't be had
+        if not self.ensure_mirror(project, url, commit_id):
+            return None
+        
+        worktree = self.worktree_path(project)
+        if not os.path.exists(os.path.join(worktree, ".git")):
+            if os.path.exists(worktree):
+                shutil.rmtree(worktree, ignore_errors=True)
+            _git(["worktree", "prune"], cwd=self.mirror_path(project))
+            result = _git(["worktree", "add", "--detach", "--force", os.path.abspath(worktree), commit_id], cwd=self.mirror_path(project))
+            if result.returncode != 0:
+                print("Couldn't create worktree for", project, result.stderr.strip())
+                return None
+        
+        cloner = Cloner(self.projects_dir)
+        cloner.path = project
+        return cloner
+    
+    def remove_worktree(self, project : str) -> None:
+        self.remove_worktree_at(project, self.worktree_path(project))
+    
+    def add_worktree(self, project : str, revision : str, path : str) -> bool:
+        # a separate worktree at revision, for when one per project isn't enough
+        result = _git(["worktree", "add", "--detach", "--force", os.path.abspath(path), revision], cwd=self.mirror_path(project))
+        if result.returncode != 0:
+            print("Couldn't create worktree at", revision, "for", project, result.stderr.strip())
+            return False
+        return True
+    
+    def remove_worktree_at(self, project : str, path : str) -> None:
+        _git(["worktree", "remove", "--force", os.path.abspath(path)], cwd=self.mirror_path(project))
+    
+    def lease_worktree(self, project : str, revision : str) -> str:
+        # A worktree at revision that only the caller uses until release_worktree, None on failure.
+        # A released one is switched over with a checkout, which only rewrites the files that
+        # differ; a new one is only added while all the others are leased out.
+        # Call with lock(project) held
+        released = self.__released.setdefault(project, [])
+        if released:
+            path = released.pop()
+            result = _git(["checkout", "--quiet", "--detach", "--force", revision], cwd=path)
+            if result.returncode == 0:
+                return path
+            print("Couldn't check out", revision, "for", project, result.stderr.strip())
+            self.remove_worktree_at(project, path)
+            return None
+        
+        self.__leased[project] = self.__leased.get(project, 0) + 1
+        path = os.path.join(self.projects_dir, f"{project}-{self.__leased[project]}")
+        if os.path.exists(path):
+            # left over by an earlier run
+            shutil.rmtree(path)
+            _git(["worktree", "prune"], cwd=self.mirror_path(project))
+        return path if self.add_worktree(project, revision, path) else None
+    
+    def release_worktree(self, project : str, path : str) -> None:
+        # call with lock(project) held
+        self.__released.setdefault(project, []).append(path)
+    
+    def remove_released_worktrees(self, keep : str = None) -> None:
+        # the released worktrees of every project but keep, for once a project's entries are done
+        with self.__locks_guard:
+            projects = [project for project in self.__released if project != keep]
+        for project in projects:
+            with self.lock(project):
+                for path in self.__released.pop(project, []):
+                    self.remove_worktree_at(project, path)
+
@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+from parsers import LANGUAGES
+from split import Chunker
+
+# Checks that the query engine gives the same tuples as the AST walk, file by file.
+# usage: python compare_engines.py <repo_path> [<repo_path> ...]
+
+
+def code_files(repo_path):
+    for root, dirs, files in os.walk(repo_path):
+        for file in files:
+            if os.path.splitext(file)[1] in LANGUAGES:
+                yield os.path.join(root, file)
+
+
+def compare(repo_path, walk_chunker, query_chunker):
+    mismatches = []
+    files = 0
+    skipped = 0
+    functions = 0
+    walk_time = 0.0
+    query_time = 0.0
+
+    for file_path in code_files(repo_path):
+        try:
+            with open(file_path, 'rb') as f:
+                content = f.read()
+        except OSError:
+            continue
+
+        start = time.perf_counter()
+        try:
+            expected = walk_chunker.walk_callees_and_body(file_path, content)
+        except RecursionError:
+            # deeply nested code is past what the recursive walk can handle, nothing to compare with
+            skipped += 1
+            continue
+        walk_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = query_chunker.extract_callees_and_body(file_path)
+        query_time += time.perf_counter() - start
+
+        files += 1
+        functions += len(expected)
+        if expected != actual:
+            mismatches.append((file_path, expected, actual))
+
+    return files, skipped, functions, walk_time, query_time, mismatches
+
+
+def main():
+    walk_chunker = Chunker(engine="walk")
+    query_chunker = Chunker(engine="query")
+    failed = False
+
+    for repo_path in sys.argv[1:]:
+        files, skipped, functions, walk_time, query_time, mismatches = compare(repo_path, walk_chunker, query_chunker)
+        print(f"{repo_path}: {files} files ({skipped} too deep for the walk), {functions} functions, walk {walk_time:.2f}s, query {query_time:.2f}s, {len(mismatches)} mismatches")
+
+        for file_path, expected, actual in mismatches:
+            failed = True
+            print("mismatch in", file_path)
+            for expected_chunk, actual_chunk in zip(expected, actual):
+                if expected_chunk != actual_chunk:
+                    print("  walk: ", expected_chunk[:3])
+                    print("  query:", actual_chunk[:3])
+                    break
+            if len(expected) != len(actual):
+                print(f"  walk found {len(expected)} functions, query found {len(actual)}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+from bisect import bisect_left
+from tree_sitter_languages import get_language, get_parser
+
+
+def _function_types(language):
+    # The walk in Chunker matches with `node.type in ('function_definition')`, a substring
+    # test, so JavaScript's `function` nodes count too. Pick the same kinds here.
+    function_types = []
+    for kind_id in range(language.node_kind_count):
+        kind = language.node_kind_for_id(kind_id)
+        if kind and language.node_kind_is_named(kind_id) and kind in 'function_definition' and kind not in function_types:
+            function_types.append(kind)
+    return function_types
+
+
+def _has_kind(language, kind):
+    return any(language.node_kind_for_id(kind_id) == kind for kind_id in range(language.node_kind_count))
+
+
+# Extracts the same (file_path, signature, callees, body) tuples as
+# Chunker.extract_callees_and_body, from one compiled query run per file.
+#
+# The query captures every function and call expression in document order. Functions
+# nested in another one are dropped (the walk never goes into a function), the rest are
+# returned last to first (the order the walk's stack pops them). A function's callees are
+# the outermost calls in its body. The source is decoded once per file, and text is sliced
+# out of it with the node byte offsets, exactly like get_node_text does.
+class QueryExtractor:
+    def __init__(self, language_name : str, parser=None):
+        self.language = get_language(language_name)
+        self.parser = parser if parser is not None else get_parser(language_name)
+
+        patterns = [f"({kind}) @function" for kind in _function_types(self.language)]
+        if _has_kind(self.language, 'call_expression'):
+            patterns.append("(call_expression) @call")
+        self.query = self.language.query(" ".join(patterns)) if patterns else None
+
+    def extract(self, file_path, content : bytes) -> list:
+        return [
+            (file_path, function_signature, callees, content[start_byte:end_byte].decode('utf-8', errors='replace'))
+            for function_signature, callees, start_byte, end_byte in self.extract_offsets(content)
+        ]
+
+    def extract_offsets(self, content : bytes) -> list:
+        # (signature, callees, start_byte, end_byte) per function, bodies left in the file
+        if self.query is None:
+            return []
+
+        tree = self.parser.parse(content)
+        source_code = content.decode('utf-8', errors='replace')
+
+        functions = []
+        calls = []
+        function_end = -1
+        for node, capture in self.query.captures(tree.root_node):
+            if capture == 'function':
+                if node.start_byte < function_end:
+                    continue
+                functions.append(node)
+                function_end = node.end_byte
+            else:
+                calls.append(node)
+        call_starts = [node.start_byte for node in calls]
+
+        chunks = []
+        for node in reversed(functions):
+            function_signature, body_node = self.__signature_and_body(node, source_code)
+            callees = self.__callees(body_node, calls, call_starts, source_code)
+            chunks.append((function_signature, callees, node.start_byte, node.end_byte))
+        return chunks
+
+    @staticmethod
+    def __text(node, source_code):
+        return source_code[node.start_byte:node.end_byte]
+
+    def __callees(self, body_node, calls, call_starts, source_code):
+        if body_node is None:
+            return []
+
+        callees = []
+        call_end = -1
+        idx = bisect_left(call_starts, body_node.start_byte)
+        while idx < len(calls) and call_starts[idx] < body_node.end_byte:
+            node = calls[idx]
+            idx += 1
+            # calls inside another call's arguments aren't callees of their own
+            if node.start_byte < call_end:
+                continue
+            call_end = node.end_byte
+            function_name_node = node.child_by_field_name('function')
+            if function_name_node:
+                callees.append(self.__text(function_name_node, source_code))
+        return callees
+
+    def __signature_and_body(self, node, source_code):
+        # one pass over the children for what get_function_signature looks up one kind at a time
+        storage_specifiers = []
+        function_specifiers = []
+        return_type_node = None
+        function_declarator_node = None
+        trailing_return_type_node = None
+        body_node = None
+
+        for child in node.children:
+            child_type = child.type
+            if child_type in ('storage_class_specifier', 'type_qualifier'):
+                storage_specifiers.append(self.__text(child, source_code))
+            if child_type in ('noexcept', 'type_qualifier'):
+                function_specifiers.append(self.__text(child, source_code))
+            if child_type == 'type_descriptor' and return_type_node is None:
+                return_type_node = child
+            elif child_type == 'function_declarator' and function_declarator_node is None:
+                function_declarator_node = child
+            elif child_type == 'trailing_return_type' and trailing_return_type_node is None:
+                trailing_return_type_node = child
+            elif child_type == 'compound_statement' and body_node is None:
+                body_node = child
+
+        signature_parts = storage_specifiers
+
+        if return_type_node:
+            signature_parts.append(self.__text(return_type_node, source_code))
+
+        if function_declarator_node:
+            identifier_node, parameters_node = self.__identifier_and_parameters(function_declarator_node)
+            if identifier_node:
+                signature_parts.append(self.__text(identifier_node, source_code))
+            if parameters_node:
+                signature_parts.append(self.__text(parameters_node, source_code))
+
+        if trailing_return_type_node:
+            signature_parts.append(self.__text(trailing_return_type_node, source_code))
+
+        signature_parts.extend(function_specifiers)
+
+        parent_node = node.parent
+        if parent_node and parent_node.type == 'template_declaration':
+            template_node = parent_node.child_by_field_name('parameters')
+            if template_node:
+                signature_parts.insert(0, f"template{self.__text(template_node, source_code)}")
+
+        return ' '.join(signature_parts).strip(), body_node
+
+    @staticmethod
+    def __identifier_and_parameters(function_declarator_node):
+        # same search order as find_identifier_and_parameters in Chunker.get_function_signature
+        identifier_node = None
+        parameters_node = None
+        stack = [iter(function_declarator_node.children)]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                continue
+            if child.type == 'identifier' and identifier_node is None:
+                identifier_node = child
+            elif child.type == 'parameter_list' and parameters_node is None:
+                parameters_node = child
+            else:
+                stack.append(iter(child.children))
+        return identifier_node, parameters_node
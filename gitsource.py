@@ -0,0 +1,68 @@
+import os
+import subprocess
+
+# git modes of the tree entries read as files, symlinks (120000) and submodules (160000) are not
+FILE_MODES = ("100644", "100755")
+
+
+# Files of a commit read straight out of a repository's object database, no checkout needed.
+#
+# repo_path can be a worktree, a plain clone or a bare mirror, and revision anything
+# `git rev-parse` understands ("<commit>^" included). A single `git cat-file --batch`
+# process serves every blob, so a tree costs two git processes however many files it has.
+class GitTree:
+    def __init__(self, repo_path : str, revision : str):
+        self.repo_path = repo_path
+        self.revision = revision
+        self.__process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def entries(self) -> list:
+        # (path, blob id, size) of every file in the tree, paths relative to the repository root
+        result = subprocess.run(
+            ["git", "ls-tree", "-r", "-z", "--long", "--full-tree", self.revision],
+            cwd=self.repo_path, capture_output=True
+        )
+        if result.returncode != 0:
+            raise ValueError(f"can't list {self.revision} in {self.repo_path}: {result.stderr.decode(errors='replace').strip()}")
+
+        entries = []
+        for record in result.stdout.split(b"\0"):
+            if not record:
+                continue
+            meta, path = record.split(b"\t", 1)
+            mode, kind, blob, size = meta.split()
+            if kind != b"blob" or mode.decode() not in FILE_MODES:
+                continue
+            entries.append((os.fsdecode(path), blob.decode(), int(size)))
+        return entries
+
+    def read(self, blob : str) -> bytes:
+        if self.__process is None:
+            self.__process = subprocess.Popen(
+                ["git", "cat-file", "--batch"], cwd=self.repo_path, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+            )
+        self.__process.stdin.write(blob.encode() + b"\n")
+        self.__process.stdin.flush()
+
+        header = self.__process.stdout.readline().split()
+        if len(header) != 3:
+            raise ValueError(f"blob {blob} is missing from {self.repo_path}")
+        size = int(header[2])
+        content = self.__process.stdout.read(size)
+        # every object is followed by a newline
+        self.__process.stdout.read(1)
+        return content
+
+    def close(self) -> None:
+        if self.__process is None:
+            return
+        self.__process.stdin.close()
+        self.__process.wait()
+        self.__process.stdout.close()
+        self.__process = None
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import orjson
+
+DATASETS = ("train", "test", "valid")
+
+# the only fields the pairing run reads, everything else (mostly text) is dropped on load
+FIELDS = ("project", "commit_id", "func", "cwe")
+
+
+def dataset_paths(data_dir : str = "functional", datasets=DATASETS) -> list:
+    return [os.path.join(data_dir, f"primevul_{dataset}.jsonl") for dataset in datasets]
+
+
+def _has_cwe(record, cwes):
+    cwe = record.get("cwe")
+    if isinstance(cwe, list):
+        return any(c in cwes for c in cwe)
+    return cwe in cwes
+
+
+def project_shard(project : str, shards : int) -> int:
+    # stable across processes and hosts, unlike hash()
+    return int.from_bytes(hashlib.sha1(str(project).encode('utf-8')).digest()[:8], 'big') % shards
+
+
+def _keep(record, target, cwes, projects, shard=None, shards=1):
+    if target is not None and record.get("target") != target:
+        return False
+    if cwes is not None and not _has_cwe(record, cwes):
+        return False
+    if projects is not None and record.get("project") not in projects:
+        return False
+    if shard is not None and project_shard(record.get("project"), shards) != shard:
+        return False
+    return True
+
+
+def _project(record, fields):
+    if fields is None:
+        return record
+    return {field: record.get(field) for field in fields}
+
+
+def _read_records(paths):
+    # yields (path, offset, record) one line at a time
+    for path in paths:
+        with open(path, 'rb') as file:
+            offset = 0
+            for line in file:
+                if line.strip():
+                    yield path, offset, orjson.loads(line)
+                offset += len(line)
+
+
+def stream_entries(paths=None, target=1, cwes=None, projects=None, fields=FIELDS):
+    # lazily reads the splits, keeping only matching records and only the given fields
+    if paths is None:
+        paths = dataset_paths()
+    cwes = set(cwes) if cwes is not None else None
+    projects = set(projects) if projects is not None else None
+
+    for _, _, record in _read_records(paths):
+        if _keep(record, target, cwes, projects):
+            yield _project(record, fields)
+
+
+def project_order(paths=None, target=1, cwes=None, projects=None) -> list:
+    # the projects stream_entries_by_project goes through, in its order
+    if paths is None:
+        paths = dataset_paths()
+    cwes = set(cwes) if cwes is not None else None
+    projects = set(projects) if projects is not None else None
+
+    order = dict()
+    for _, _, record in _read_records(paths):
+        if _keep(record, target, cwes, projects):
+            order.setdefault(record.get("project"), None)
+    return list(order)
+
+
+def stream_entries_by_project(paths=None, target=1, cwes=None, projects=None, fields=FIELDS, shard : int = None, shards : int = 1):
+    # Same records as stream_entries, with each project's entries back to back, in the
+    # order projects first show up. The first pass only remembers where matching lines
+    # are, the second reads them back one at a time, so memory stays flat.
+    # With shard, only the projects project_shard puts in that shard (out of shards)
+    if paths is None:
+        paths = dataset_paths()
+    cwes = set(cwes) if cwes is not None else None
+    projects = set(projects) if projects is not None else None
+
+    locations = dict()
+    for path, offset, record in _read_records(paths):
+        if _keep(record, target, cwes, projects, shard, shards):
+            locations.setdefault(record.get("project"), []).append((path, offset))
+
+    files = dict()
+    try:
+        for project_locations in locations.values():
+            for path, offset in project_locations:
+                if path not in files:
+                    files[path] = open(path, 'rb')
+                file = files[path]
+                file.seek(offset)
+                yield _project(orjson.loads(file.readline()), fields)
+    finally:
+        for file in files.values():
+            file.close()
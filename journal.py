@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import time
+
+PAIRED = "paired"
+NO_URL = "no_url"
+FETCH_FAILED = "fetch_failed"
+VULNERABLE_NOT_FOUND = "vulnerable_not_found"
+BENIGN_NOT_FOUND = "benign_not_found"
+ERROR = "error"
+
+# what a rerun would come to again; fetch failures and errors may be transient, so get retried
+FINAL = (PAIRED, NO_URL, VULNERABLE_NOT_FOUND, BENIGN_NOT_FOUND)
+
+
+def entry_key(entry) -> tuple:
+    # PrimeVul has several functions per fix commit, so the function is part of the key
+    digest = hashlib.sha1(entry.get("func", "").encode('utf-8', errors='replace')).hexdigest()[:16]
+    return (entry["project"], entry["commit_id"], digest)
+
+
+# Append-only record of what happened to every entry of a pairing run, one JSON line
+# each, flushed to disk before the next entry starts. A resumed run skips every entry an
+# earlier run got a FINAL outcome for, without touching git, and retries the ones that
+# failed. A line torn by a crash is ignored on load.
+class ProgressJournal:
+    def __init__(self, path : str = "progress.jsonl", resume : bool = True):
+        self.path = path
+        self.outcomes = dict()
+        if resume:
+            self.__load()
+        self.__file = open(path, 'a')
+        # start on a fresh line if the last run died half way through one
+        if self.__file.tell() > 0:
+            with open(path, 'rb') as file:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    self.__file.write("\n")
+
+    def __load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self.outcomes[(record["project"], record["commit_id"], record["function"])] = record["outcome"]
+
+    def done(self, entry) -> bool:
+        # only what earlier runs recorded, this run doesn't skip its own duplicates
+        return self.outcomes.get(entry_key(entry)) in FINAL
+
+    def record(self, entry, outcome : str, detail : str = None) -> None:
+        project, commit_id, function = entry_key(entry)
+        record = {
+            "project": project,
+            "commit_id": commit_id,
+            "function": function,
+            "outcome": outcome,
+            "time": time.time(),
+        }
+        if detail is not None:
+            record["detail"] = detail
+        self.__file.write(json.dumps(record) + "\n")
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+    def close(self) -> None:
+        self.__file.close()
@@ -0,0 +1,45 @@
+import re
+
+IDENTIFIER = re.compile(rb"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def identifiers(name : str) -> list:
+    # the identifiers in a name as the parser reports it, "ns::Foo::bar" or "ctx->ops->read"
+    return [token.decode() for token in IDENTIFIER.findall(name.encode('utf-8', errors='replace'))]
+
+
+def key_identifier(name : str) -> str:
+    # the identifier a file has to contain to mention name, its last one: "bar" for "static int Foo::bar"
+    tokens = identifiers(name)
+    return tokens[-1] if tokens else None
+
+
+# Which files mention which identifiers, from a plain byte scan of every file (no parsing).
+#
+# Comments and strings count as mentions, so a lookup gives a superset of the files a
+# parse would find a name in, never less. Lookups give the files in the order they were indexed.
+class IdentifierIndex:
+    def __init__(self, file_paths):
+        self.file_paths = []
+        self.files = dict()
+        for file_path in file_paths:
+            try:
+                with open(file_path, 'rb') as f:
+                    content = f.read()
+            except OSError:
+                continue
+            idx = len(self.file_paths)
+            self.file_paths.append(file_path)
+            for identifier in set(IDENTIFIER.findall(content)):
+                self.files.setdefault(identifier.decode(), []).append(idx)
+
+    def __len__(self):
+        return len(self.file_paths)
+
+    def files_mentioning(self, names) -> list:
+        indices = set()
+        for name in names:
+            identifier = key_identifier(name)
+            if identifier is not None:
+                indices.update(self.files.get(identifier, ()))
+        return [self.file_paths[idx] for idx in sorted(indices)]
@@ -3,7 +3,12 @@ from clone import Cloner
 from split import Chunker
 import os
 from pprint import pprint 
-from difflib import SequenceMatcher
+from similarity import TargetMatcher
+from ingest import stream_entries
+from output import ShardedWriter
+from pool import FunctionPool
+
+BENCHMARK_PATH = './benchmark/{shard}.jsonl'
 
 def load_jsonl(file_path):
     data = []
@@ -17,72 +22,95 @@ def load_json(file_path):
         data = json.load(file)
     return data
 
-def create_dataset(data, cwe, commit_id, vulnerable_function):
-    with open(f'./benchmark/{cwe}.jsonl', 'w') as file:
-        for entry in data:
-            file_path, function_signature, callees, function_body = entry
-            
-            similarity = SequenceMatcher(None,function_body.replace(" ", ""), vulnerable_function.replace(" ", "")).ratio()
-            if similarity > 0.9:
-                print('vulnerable function')
-                vulnerable_entry = {
-                    'file_path': file_path,
-                    'function_signature': function_signature,
-                    'callees': callees,
-                    'function_body': function_body,
-                    'cwe': cwe,
-                    'commit_id': commit_id,
-                    'vulnerable' : 1
-                }
-                continue
-            
-            new_entry = {
+def normalize_function_body(function_body):
+    return function_body.replace(" ", "")
+
+def create_dataset(data, cwe, commit_id, vulnerable_function, writer : ShardedWriter = None, pool : FunctionPool = None):
+    # data can be a stream (Chunker.iter_records), every body is read once and written out.
+    # Without a writer this call's functions replace ./benchmark/{cwe}.jsonl; main passes
+    # one writer for the whole run, so every project ends up in its CWE's file.
+    # With a pool, bodies it has seen with this function aren't compared again, and if
+    # it stores bodies the records hold "function_body_id" in place of "function_body"
+    if writer is None:
+        with ShardedWriter(BENCHMARK_PATH) as writer:
+            return create_dataset(data, cwe, commit_id, vulnerable_function, writer, pool)
+    
+    if pool is not None:
+        matcher = pool.matcher(vulnerable_function)
+    else:
+        matcher = TargetMatcher(vulnerable_function, normalize_function_body)
+    pooled = pool is not None and pool.path is not None
+    vulnerable_entry = None
+    
+    for entry in data:
+        file_path, function_signature, callees, function_body = entry
+        body = {'function_body_id': pool.add(function_body)} if pooled else {'function_body': function_body}
+        
+        if matcher.matches_body(function_body):
+            print('vulnerable function')
+            vulnerable_entry = {
                 'file_path': file_path,
                 'function_signature': function_signature,
                 'callees': callees,
-                'function_body': function_body,
+                **body,
                 'cwe': cwe,
                 'commit_id': commit_id,
-                'vulnerable' : 0
+                'vulnerable' : 1
             }
-            
-            file.write(json.dumps(new_entry) + '\n')
-        file.write(json.dumps(vulnerable_entry) + '\n')
+            continue
+        
+        new_entry = {
+            'file_path': file_path,
+            'function_signature': function_signature,
+            'callees': callees,
+            **body,
+            'cwe': cwe,
+            'commit_id': commit_id,
+            'vulnerable' : 0
+        }
+        
+        writer.write(new_entry, shard=cwe)
+    if vulnerable_entry is not None:
+        writer.write(vulnerable_entry, shard=cwe)
     
         
 
-def main():
+def main(pool_path : str = None):
+    # pool_path writes each distinct body once, to that file, instead of in every record (see pool.load_pool)
     file_path = './new_benchmark.jsonl'
-    data = load_jsonl(file_path)
+    data = stream_entries([file_path], target=None, cwes=["CWE-77"], fields=None)
     
     file_path = './mapping.json'
     mapping = load_json(file_path)
     
     cloner = Cloner()
+    # no store, functions.sqlite is pairwise.main's
     chunker = Chunker()
-    
-    for entry in data:
-        if entry["cwe"] != "CWE-77":
-            continue
-        project = entry['project']
-        url = mapping[project]
-        commit_id = entry['commit_id']
-        vulnerable_function = entry['function']
-        
-        print("cloning", project)
-        
-        # cloner.remove_repo()
-        # cloner.clone(url)
-        
-        # cloner.checkout_to_vulnerable(entry['commit_id'])
-        
-        processed_data = chunker.read_and_parse_documents_with_callees(os.path.join(cloner.projects_dir, cloner.path))
+    # entries of one project see mostly the same bodies, each is compared with a function once
+    pool = FunctionPool(normalize_function_body, path=pool_path)
+    try:
+        # one file per CWE, put in place once the whole run is through (a failed run leaves the old ones)
+        with ShardedWriter(BENCHMARK_PATH, shard_by='cwe') as writer:
+            for entry in data:
+                project = entry['project']
+                url = mapping[project]
+                commit_id = entry['commit_id']
+                vulnerable_function = entry['function']
         
-        create_dataset(processed_data, entry['cwe'], commit_id, vulnerable_function)
+                print("cloning", project)
         
+                # cloner.remove_repo()
+                # cloner.clone(url)
         
+                # cloner.checkout_to_vulnerable(entry['commit_id'])
         
+                processed_data = chunker.iter_records(os.path.join(cloner.projects_dir, cloner.path))
         
+                create_dataset(processed_data, entry['cwe'], commit_id, vulnerable_function, writer, pool)
+            # the bodies the records point to are on disk before the records are put in place
+            pool.flush()
+    finally:
+        pool.close()
 
 
 if __name__ == '__main__':
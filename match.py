@@ -1,60 +1,84 @@
 import json
 import glob
+import os
+import orjson
+from concurrent.futures import ProcessPoolExecutor
+from callgraph import CallGraph, get_function_name
 
 def read_jsonl(file_path):
     with open(file_path, 'r') as file:
         for line in file:
             yield json.loads(line)
 
-def get_function_name(function_signature):
-    return function_signature.split('(')[0].strip()
-
 def create_map(jsonl_file):
-    data = read_jsonl(jsonl_file)
-    
+    # one pass over the file, the graph keeps what the second read used to fetch
+    return CallGraph.from_jsonl(jsonl_file).mapping()
+
+def mapping_path(jsonl_file):
+    directory, file_name = os.path.split(jsonl_file)
+    return os.path.join(directory, f"{os.path.splitext(file_name)[0]}_mapping.json")
+
+def build_mapping(jsonl_file, output_path : str = None) -> str:
+    # Writes create_map(jsonl_file) to output_path as compact JSON, without holding the bodies:
+    # one pass keeps every name's signature, callees and where its last definition starts,
+    # then the mapping is written a name at a time, each body read back from its line.
+    # Same keys, values and order as create_map; returns where it was written
+    if output_path is None:
+        output_path = mapping_path(jsonl_file)
+
+    signatures = dict()
     callees_map = dict()
-    for entry in data:
-        function_signature = entry['function_signature']
-        function_name = get_function_name(function_signature)
-        callees = entry['callees']
-        callees_map[function_name] = callees
-    
+    offsets = dict()
+    with open(jsonl_file, 'rb') as file:
+        offset = 0
+        for line in file:
+            entry = orjson.loads(line)
+            function_name = get_function_name(entry['function_signature'])
+            signatures[function_name] = entry['function_signature']
+            callees_map[function_name] = entry['callees']
+            offsets[function_name] = offset
+            offset += len(line)
+
+    # built like CallGraph.callers_map
     callers_map = dict()
     for key, value in callees_map.items():
         for callee in value:
-            if callee not in callers_map:
-                callers_map[callee] = list()
-            callers_map[callee].append(key)
-    
-    mappings = dict()
-    data = read_jsonl(jsonl_file)
-
-    for entry in data:
-        function_signature = entry['function_signature']
-        function_name = get_function_name(function_signature)
-        function_body = entry['function_body']
-        
-        mappings[function_name] = {
-            'function_signature': function_signature,
-            'function_body': function_body,
-            'callees': callees_map.get(function_name, []),
-            'callers': callers_map.get(function_name, [])
-        }
-       
-    return mappings
+            callers_map.setdefault(callee, []).append(key)
+
+    tmp_path = f"{output_path}.tmp-{os.getpid()}"
+    with open(jsonl_file, 'rb') as source, open(tmp_path, 'wb') as out:
+        out.write(b"{")
+        for idx, (function_name, function_signature) in enumerate(signatures.items()):
+            source.seek(offsets[function_name])
+            record = orjson.loads(source.readline())
+            # a benchmark written with a pool points to the body, the mapping does the same
+            body_field = 'function_body' if 'function_body' in record else 'function_body_id'
+            value = {
+                'function_signature': function_signature,
+                body_field: record[body_field],
+                'callees': callees_map[function_name],
+                'callers': callers_map.get(function_name, [])
+            }
+            out.write(b"," if idx else b"")
+            out.write(orjson.dumps(function_name) + b":" + orjson.dumps(value))
+        out.write(b"}")
+    os.replace(tmp_path, output_path)
+    return output_path
+
+def load_mapping(path):
+    with open(path, 'rb') as file:
+        return orjson.loads(file.read())
 
 def find_jsonl_files(directory):
     return glob.glob(f"{directory}/*.jsonl")
 
-def main():
-    jsonl_files = find_jsonl_files('./benchmark')
+def main(workers : int = None):
+    # one file per process, the largest first so a big CWE doesn't start last
+    jsonl_files = sorted(find_jsonl_files('./benchmark'), key=os.path.getsize, reverse=True)
 
-    for jsonl_file in jsonl_files:
-        file_name = jsonl_file.split('/')[-1].split('.')[0]
-        print(f"Processing file: {file_name}")
-        map = create_map(jsonl_file)
-        with open(f'./benchmark/{file_name}_mapping.json', 'w') as outfile:
-            json.dump(map, outfile, indent=4)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for jsonl_file, output_path in zip(jsonl_files, executor.map(build_mapping, jsonl_files)):
+            print(f"Processed file: {os.path.basename(jsonl_file)} -> {output_path}")
 
 if __name__ == '__main__':
     main()
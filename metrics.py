@@ -0,0 +1,165 @@
+import cProfile
+import heapq
+import json
+import math
+import threading
+import time
+
+# how many of the slowest files to keep
+SLOWEST_FILES = 20
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.metrics.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+# Stage timers, counters and per-file parse times for a run.
+#
+# Off by default: stage() then hands back a shared no-op context manager and count()
+# returns straight away, so the hooks left in the hot paths cost an attribute lookup.
+# Call enable() (or run with metrics=True) to collect, and dump() at the end of the run.
+# Only what runs in this process is seen, pool workers keep their own.
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        # the pipeline's stage threads all report here
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.stages = dict()
+        self.counters = dict()
+        self.histograms = dict()
+        self.slowest_files = []
+        self.entries = []
+        self.__entry = None
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def stage(self, name : str):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def add_time(self, name : str, seconds : float) -> None:
+        with self.__lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = {"calls": 0, "seconds": 0.0, "max_seconds": 0.0}
+            stage["calls"] += 1
+            stage["seconds"] += seconds
+            if seconds > stage["max_seconds"]:
+                stage["max_seconds"] = seconds
+
+    def count(self, name : str, n : int = 1) -> None:
+        if self.enabled:
+            with self.__lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name : str, seconds : float) -> None:
+        # power of two buckets in milliseconds: bucket b holds times up to 2**b ms
+        if not self.enabled:
+            return
+        bucket = max(0, math.ceil(math.log2(seconds * 1000))) if seconds > 0 else 0
+        with self.__lock:
+            histogram = self.histograms.setdefault(name, dict())
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    def observe_file(self, file_path : str, seconds : float, size : int) -> None:
+        if not self.enabled:
+            return
+        self.observe("parse_file", seconds)
+        record = (seconds, file_path, size)
+        with self.__lock:
+            if len(self.slowest_files) < SLOWEST_FILES:
+                heapq.heappush(self.slowest_files, record)
+            elif record > self.slowest_files[0]:
+                heapq.heapreplace(self.slowest_files, record)
+
+    def begin_entry(self, **labels) -> None:
+        if not self.enabled:
+            return
+        self.__entry = (
+            labels,
+            time.perf_counter(),
+            dict(self.counters),
+            {name: stage["seconds"] for name, stage in self.stages.items()},
+        )
+
+    def end_entry(self, **labels) -> None:
+        # what changed since begin_entry, kept as one record per entry
+        if not self.enabled or self.__entry is None:
+            return
+        start_labels, start, counters, stages = self.__entry
+        self.__entry = None
+        record = dict(start_labels)
+        record.update(labels)
+        record["seconds"] = time.perf_counter() - start
+        record["counters"] = {
+            name: value - counters.get(name, 0) for name, value in self.counters.items() if value != counters.get(name, 0)
+        }
+        record["stages"] = {
+            name: stage["seconds"] - stages.get(name, 0.0) for name, stage in self.stages.items() if stage["seconds"] != stages.get(name, 0.0)
+        }
+        self.entries.append(record)
+
+    def as_dict(self) -> dict:
+        return {
+            "stages": self.stages,
+            "counters": self.counters,
+            "histograms": {
+                name: {f"<={2 ** bucket}ms": count for bucket, count in sorted(histogram.items())}
+                for name, histogram in self.histograms.items()
+            },
+            "slowest_files": [
+                {"file_path": file_path, "seconds": seconds, "bytes": size}
+                for seconds, file_path, size in sorted(self.slowest_files, reverse=True)
+            ],
+            "entries": self.entries,
+        }
+
+    def dump(self, path : str = "metrics.json") -> None:
+        with open(path, 'w') as file:
+            json.dump(self.as_dict(), file, indent=2)
+
+
+metrics = Metrics()
+
+
+def start_profile() -> cProfile.Profile:
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profile(profiler : cProfile.Profile, path : str) -> None:
+    # stats go to path, read them with pstats or snakeviz
+    profiler.disable()
+    profiler.dump_stats(path)
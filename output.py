@@ -0,0 +1,137 @@
+import os
+import orjson
+from metrics import metrics
+
+
+def dumps(record) -> bytes:
+    return orjson.dumps(record) + b"\n"
+
+
+# Buffered JSONL output, optionally split in shards (one file per CWE, project, ...).
+#
+# path is a template such as "./benchmark/{shard}.jsonl"; without "{shard}" every
+# record goes to the one file. Records are serialized with orjson and written a batch
+# at a time. In "w" mode each shard is written to a temporary file that only replaces
+# the real one on finalize(), so readers never see half a run and a failed run leaves
+# the old files alone. In "a" mode batches are appended and fsynced as they go, and
+# the on_flush callbacks given to write() run once their record is on disk.
+class ShardedWriter:
+    def __init__(self, path : str, shard_by=None, mode : str = "w", batch_size : int = 256):
+        if mode not in ("w", "a"):
+            raise ValueError(f"unknown mode: {mode}")
+        self.path = path
+        self.shard_by = shard_by
+        self.mode = mode
+        self.batch_size = batch_size
+        self.records = 0
+
+        self.__buffers = dict()
+        self.__callbacks = dict()
+        self.__files = dict()
+        self.__finalized = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.finalize()
+        else:
+            self.abort()
+
+    def __shard(self, record, shard):
+        # one path is one buffer and one file: without "{shard}" the shard is ignored,
+        # so records keep the order they were written in
+        if "{shard}" not in self.path:
+            return ""
+        if shard is not None:
+            return str(shard)
+        if self.shard_by is None:
+            return ""
+        if callable(self.shard_by):
+            return str(self.shard_by(record))
+        return str(record[self.shard_by])
+
+    def shard_path(self, shard : str) -> str:
+        return self.path.format(shard=shard)
+
+    def __tmp_path(self, shard):
+        return f"{self.shard_path(shard)}.tmp-{os.getpid()}"
+
+    def __file(self, shard):
+        file = self.__files.get(shard)
+        if file is None:
+            path = self.shard_path(shard)
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if self.mode == "a":
+                file = open(path, 'ab')
+            else:
+                file = open(self.__tmp_path(shard), 'wb')
+            self.__files[shard] = file
+        return file
+
+    def write(self, record, shard : str = None, on_flush=None) -> None:
+        shard = self.__shard(record, shard)
+        buffer = self.__buffers.setdefault(shard, [])
+        buffer.append(dumps(record))
+        if on_flush is not None:
+            self.__callbacks.setdefault(shard, []).append(on_flush)
+        self.records += 1
+        if len(buffer) >= self.batch_size:
+            self.__flush_shard(shard)
+
+    def __flush_shard(self, shard):
+        buffer = self.__buffers.get(shard)
+        if not buffer:
+            return
+        with metrics.stage("write"):
+            file = self.__file(shard)
+            file.write(b"".join(buffer))
+            metrics.count("records_written", len(buffer))
+            buffer.clear()
+            if self.mode == "a":
+                file.flush()
+                os.fsync(file.fileno())
+
+        for callback in self.__callbacks.pop(shard, []):
+            callback()
+
+    def flush(self) -> None:
+        for shard in list(self.__buffers):
+            self.__flush_shard(shard)
+
+    def finalize(self) -> None:
+        if self.__finalized:
+            return
+        self.flush()
+        for shard, file in self.__files.items():
+            file.flush()
+            os.fsync(file.fileno())
+            file.close()
+            if self.mode == "w":
+                os.replace(self.__tmp_path(shard), self.shard_path(shard))
+        self.__files.clear()
+        self.__finalized = True
+
+    def close(self) -> None:
+        self.finalize()
+
+    def abort(self) -> None:
+        # drops what wasn't written yet; in "w" mode the real files stay as they were
+        if self.__finalized:
+            return
+        if self.mode == "a":
+            self.finalize()
+            return
+        for shard, file in self.__files.items():
+            file.close()
+            try:
+                os.remove(self.__tmp_path(shard))
+            except OSError:
+                pass
+        self.__files.clear()
+        self.__buffers.clear()
+        self.__callbacks.clear()
+        self.__finalized = True
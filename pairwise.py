@@ -1,58 +1,41 @@
 import sys
 import json
 import os
-from clone import Cloner 
+from collections.abc import Sequence
+from clone import Cloner, RepositoryCache
+from ingest import FIELDS, stream_entries, stream_entries_by_project
 from split import Chunker
+from cache import ParseCache
+from store import FunctionStore
+from output import ShardedWriter
+from journal import ProgressJournal, PAIRED, NO_URL, FETCH_FAILED, VULNERABLE_NOT_FOUND, BENIGN_NOT_FOUND, ERROR
 from difflib import SequenceMatcher
+from similarity import SimilarityIndex, find_similar
+from callgraph import CallGraph, get_function_name
+from lexindex import key_identifier
+from metrics import metrics, start_profile, stop_profile
+from pool import FunctionPool
 
 
+class AssembleError(Exception):
+    pass
+
 def read_jsonl(file_path):
     with open(file_path, 'r') as file:
         for line in file:
             yield json.loads(line)
             
-def create_map(data):
-    callees_map = dict()
-    for entry in data:
-        file_path, function_signature, callees, function_body = entry
-        function_name = get_function_name(function_signature)
-        callees_map[function_name] = callees
-    
-    callers_map = dict()
-    for key, value in callees_map.items():
-        for callee in value:
-            if callee not in callers_map:
-                callers_map[callee] = list()
-            callers_map[callee].append(key)
-    
-    mappings = dict()
-
-    for entry in data:
-        file_path, function_signature, callees, function_body = entry
-        function_name = get_function_name(function_signature)
-        
-        
-        mappings[function_name] = {
-            'function_signature': function_signature,
-            'function_body': function_body,
-            'callees': callees_map.get(function_name, []),
-            'callers': callers_map.get(function_name, [])
-        }
-       
-    return mappings
+def create_map(data, graph : CallGraph = None):
+    if graph is None:
+        graph = CallGraph.from_records(data)
+    return graph.mapping()
 
-def get_data() -> list:
-    data = []
-    
-    datasets = ["train", "test", "valid"]
-    
-    for dataset in datasets:
-        path = os.path.join("functional", f"primevul_{dataset}.jsonl")
-        data.extend(list(read_jsonl(path)))
-    return data 
+def get_data():
+    # streams the three splits, keeping only the fields the pairing run needs
+    return stream_entries(target=None, fields=FIELDS + ("target",))
 
-def filter(data: list) -> list:
-    return [item for item in data if item.get('target') == 1]
+def filter(data):
+    return (item for item in data if item.get('target') == 1)
 
 
 def load_mapping_json():
@@ -66,106 +49,235 @@ def check_if_same_function(function1, function2):
     similarity = SequenceMatcher(None,normalize_function_body(function1), normalize_function_body(function2)).ratio()
     return similarity > 0.9
     
-def find_vulnerable_function(data, vulnerable_function):
-    retrieved_functions = []
-    for entry in data:
-        file_path, function_signature, callees, function_body = entry
-        if check_if_same_function(function_body, vulnerable_function):
-            retrieved_functions.append(entry)
-    return retrieved_functions
+def find_vulnerable_function(data, vulnerable_function, index : SimilarityIndex = None, pool : FunctionPool = None):
+    # same decision as check_if_same_function on every entry, 
+    # but only the candidates the index can't rule out get the exact ratio.
+    # With a pool, bodies it has already compared with this function aren't compared again
+    if pool is not None and index is None:
+        return pool.find(data, vulnerable_function)
+    if index is None and not isinstance(data, Sequence):
+        # a stream, e.g. Chunker.iter_records, is matched as it goes by
+        return list(find_similar(data, vulnerable_function, normalize_function_body))
+    if index is None:
+        index = SimilarityIndex(data, normalize_function_body)
+    return index.find(vulnerable_function)
 
-def extract_callers(data, function_name):
-    callers = []
-    for entry in data:
-        file_path, function_signature, callees, function_body = entry
-        if function_name in callees:
-            callers.append({"file_path": file_path, "function_signature": function_signature, "function_body": function_body})
-    return callers
+def extract_callers(data, function_name, graph : CallGraph = None):
+    if graph is None:
+        graph = CallGraph.from_records(data)
+    return [
+        {"file_path": file_path, "function_signature": function_signature, "function_body": function_body}
+        for file_path, function_signature, callees, function_body in graph.caller_records(function_name)
+    ]
 
-def get_function_name(function_signature):
-    return function_signature.split('(')[0].strip()
+def parse_diff_scoped(vulnerable_function, cloner, chunker, commit_id, pool : FunctionPool = None):
+    repo_path = os.path.join(cloner.projects_dir, cloner.path)
+    changed_files = cloner.changed_files(commit_id)
+    if changed_files is None:
+        return None, None
+    
+    # the target function has to be in one of the files the fix touched
+    changed_files = [os.path.join(repo_path, f) for f in changed_files]
+    changed_data = chunker.read_and_parse_files(changed_files)
+    vulnerable_function_candidates = find_vulnerable_function(changed_data, vulnerable_function, pool=pool)
+    if len(vulnerable_function_candidates) != 1:
+        return changed_data, vulnerable_function_candidates
+    
+    # callers and callees can only live in files that mention their names
+    file_path, function_signature, callees, function_body = vulnerable_function_candidates[0]
+    function_name = get_function_name(function_signature)
+    names = set(callees) | {function_name, function_name.split()[-1]}
+    referencing_data = chunker.read_and_parse_documents_referencing(repo_path, names, exclude=changed_files)
+    return changed_data + referencing_data, vulnerable_function_candidates
 
-def process(vulnerable_function, cloner, chunker, project_name, commit_id):
+def parse_targeted(vulnerable_function, cloner, chunker, pool : FunctionPool = None):
+    # Parses only the files that mention the function's name, then the ones that mention
+    # its callees, found with a byte scan of the checkout. Callers and callee definitions 
+    # can't be anywhere else, so the entry comes out as a full parse would give it; 
+    # a near copy of the function under another name, in a file that never mentions it, isn't seen
+    repo_path = os.path.join(cloner.projects_dir, cloner.path)
+    function_name = key_identifier(vulnerable_function.split('(')[0])
+    if function_name is None:
+        return None, None
+    index = chunker.identifier_index(repo_path)
+    
+    defining_files = index.files_mentioning([function_name])
+    defining_data = chunker.read_and_parse_files(defining_files)
+    vulnerable_function_candidates = find_vulnerable_function(defining_data, vulnerable_function, pool=pool)
+    if len(vulnerable_function_candidates) != 1:
+        return defining_data, vulnerable_function_candidates
     
-    processed_data = chunker.read_and_parse_documents_with_callees(os.path.join(cloner.projects_dir, cloner.path))
-    vulnerable_function_candidates = find_vulnerable_function(processed_data, vulnerable_function)
+    file_path, function_signature, callees, function_body = vulnerable_function_candidates[0]
+    referencing_files = index.files_mentioning([function_name, get_function_name(function_signature), *callees])
+    
+    # in index order, like the full parse; the files parsed above aren't parsed again
+    by_file = dict()
+    for entry in defining_data:
+        by_file.setdefault(entry[0], []).append(entry)
+    parsed = set(defining_files)
+    for entry in chunker.read_and_parse_files([f for f in referencing_files if f not in parsed]):
+        by_file.setdefault(entry[0], []).append(entry)
+    processed_data = [entry for f in referencing_files for entry in by_file.get(f, [])]
+    return processed_data, vulnerable_function_candidates
+
+def process(vulnerable_function, cloner, chunker, project_name, commit_id, diff_scoped : bool = False, revision : str = None,
+            targeted : bool = False, pool : FunctionPool = None):
+    # revision is what the checkout is at (the fix commit, or its parent), 
+    # with it a chunker that has a store can skip the parse, then cloner may be None.
+    # diff_scoped and targeted parse part of the checkout, which is never stored
+    stored = revision is not None and chunker.stored(project_name, revision)
+    
+    if diff_scoped and not stored:
+        processed_data, vulnerable_function_candidates = parse_diff_scoped(vulnerable_function, cloner, chunker, commit_id, pool)
+        if processed_data is None:
+            # no usable diff, fall back to the whole tree
+            diff_scoped = False
+    elif targeted and not stored:
+        processed_data, vulnerable_function_candidates = parse_targeted(vulnerable_function, cloner, chunker, pool)
+        if processed_data is None:
+            targeted = False
+    
+    if stored or not (diff_scoped or targeted):
+        repo_path = os.path.join(cloner.projects_dir, cloner.path) if cloner is not None else None
+        if revision is not None:
+            processed_data = chunker.read_and_parse_commit(repo_path, project_name, revision)
+        else:
+            processed_data = chunker.read_and_parse_documents_with_callees(repo_path)
+        vulnerable_function_candidates = find_vulnerable_function(processed_data, vulnerable_function, pool=pool)
+    
+    return assemble(processed_data, vulnerable_function, project_name, commit_id, vulnerable_function_candidates, pool)
+
+def _pooled(function, pool):
+    # with a pool that stores bodies, the body in a create_map value is swapped for its id there (see pool.load_pool)
+    if pool is None or pool.path is None or not isinstance(function, dict):
+        return function
+    return {
+        ("function_body_id" if key == "function_body" else key): (pool.add(value) if key == "function_body" else value)
+        for key, value in function.items()
+    }
+
+def assemble(processed_data, vulnerable_function, project_name, commit_id, vulnerable_function_candidates=None,
+             pool : FunctionPool = None):
+    # the entry for one parsed revision, None unless the function is found exactly once
+    if vulnerable_function_candidates is None:
+        vulnerable_function_candidates = find_vulnerable_function(processed_data, vulnerable_function, pool=pool)
     
     if len(vulnerable_function_candidates) != 1:
         return None
     file_path, function_signature, callees, function_body = vulnerable_function_candidates[0]
     
     # extract bodies of callee functions 
-    name_to_body = create_map(processed_data)
+    with metrics.stage("call_graph"):
+        graph = CallGraph.from_records(processed_data)
+        name_to_body = create_map(processed_data, graph)
     
     try:
-        callees = [{"name": callee, "function" : name_to_body.get(callee, "")} for callee in callees]
-    except Exception:
-        print(callees)
-        input()
+        callees = [{"name": callee, "function" : _pooled(name_to_body.get(callee, ""), pool)} for callee in callees]
+    except Exception as e:
+        raise AssembleError(f"couldn't resolve callees {callees!r}") from e
     
     # extract functions calling the vulnerable function
     function_name = get_function_name(function_signature)
-    callers = extract_callers(processed_data, function_name)
-    print(callers)
-    
-    # print("done")
-    # input()
+    callers = extract_callers(processed_data, function_name, graph)
     
     # extract bodies of caller functions
     try:
-        callers = [{"name": caller, "function": name_to_body.get(caller["function_signature"],"")} for caller in callers]
-    except Exception:
-        print(callers)
-        input()
+        callers = [{"name": caller, "function": _pooled(name_to_body.get(caller["function_signature"],""), pool)} for caller in callers]
+    except Exception as e:
+        raise AssembleError(f"couldn't resolve callers {callers!r}") from e
     
     
     return {
         "project" : project_name,
         "commit_id" : commit_id,
         "function" : vulnerable_function,
-        "callers" : str(callers),
-        "callees" : str(callees) 
+        "callers" : callers,
+        "callees" : callees
     }
 
-def main():
-    # get data
-    data = get_data()
-    # filter based on vulnerabilty
-    data = filter(data)
+def main(diff_scoped : bool = False, resume : bool = False, journal_path : str = "progress.jsonl", output_path : str = "paired.jsonl",
+         metrics_path : str = None, profile_index : int = None, profile_path : str = "entry.prof", targeted : bool = False,
+         shard : int = None, shards : int = 1, pool_path : str = None, languages=None, store_path : str = "functions.sqlite"):
+    # metrics_path turns on the stage timers and counters and dumps them there at the end,
+    # profile_index runs that one entry under cProfile and writes the stats to profile_path.
+    # pool_path writes each distinct caller and callee body once to that file, the entries
+    # hold its "function_body_id" in place of "function_body".
+    # languages (e.g. parsers.C_FAMILY for PrimeVul) parses only the files of those languages
+    # store_path is the function store, shard.run_node gives each node its own
+    if metrics_path is not None:
+        metrics.enable()
+    # stream the vulnerable entries, each project's back to back
+    # so its mirror and worktree get reused; with shard, only that shard's projects (see shard.py)
+    data = stream_entries_by_project(target=1, shard=shard, shards=shards)
     # find repository
     function_repo_mapping = load_mapping_json()
-    
+    repository_cache = RepositoryCache()
+    # shared across checkouts, so the benign parse only redoes the files the fix touched
+    parse_cache = ParseCache()
+    # parses of earlier runs, commits found here skip the clone and the parse
+    function_store = FunctionStore(store_path)
+    # what happened to every entry, a resumed run skips the ones already in there
+    journal = ProgressJournal(journal_path, resume=resume)
+    # output_path may shard by project, e.g. "paired/{shard}.jsonl"
+    writer = ShardedWriter(output_path, mode="a", batch_size=32)
+    # similarity of every body already compared with a function, across revisions and entries
+    pool = FunctionPool(normalize_function_body, path=pool_path)
     
     for idx, entry in enumerate(data):
+        profiler = None
         try:
+            if journal.done(entry):
+                continue
+            if idx == profile_index:
+                profiler = start_profile()
+            metrics.begin_entry(index=idx, project=entry["project"], commit_id=entry["commit_id"])
+            
             project_name = entry["project"]
             url = function_repo_mapping.get(project_name)
             commit_id = entry['commit_id']
             vulnerable_function = entry['func']
             
             if url is None:
+                journal.record(entry, NO_URL)
                 continue
         
-            # clone repository
+            # clone repository, or reuse the project's mirror
 
-            chunker = Chunker()
-            cloner = Cloner()
-            cloner.remove_repo()
-            cloner.clone(url)
+            # compact keeps the entry's parses as FunctionTables, which the call graph reads in place
+            chunker = Chunker(cache=parse_cache, store=function_store, languages=languages, compact=True)
+            vulnerable_revision = f"{commit_id}^"
+            cloner = None
+            if not (chunker.stored(project_name, vulnerable_revision) and chunker.stored(project_name, commit_id)):
+                cloner = repository_cache.checkout(project_name, url, commit_id)
+                if cloner is None:
+                    journal.record(entry, FETCH_FAILED)
+                    continue
             
-            
-            # checkout to vulnerable
-            cloner.checkout_to_vulnerable(entry['commit_id'])
-            vulnerable_entry = process(vulnerable_function, cloner, chunker, project_name, commit_id)
+            # checkout to vulnerable; if it fails the worktree still has another commit, which
+            # mustn't be parsed (or stored) as this one
+            if cloner is not None:
+                with metrics.stage("checkout"):
+                    checked_out = cloner.checkout_to_vulnerable(entry['commit_id'])
+                if not checked_out:
+                    journal.record(entry, FETCH_FAILED)
+                    continue
+            vulnerable_entry = process(vulnerable_function, cloner, chunker, project_name, commit_id, diff_scoped, vulnerable_revision, targeted, pool)
 
             if vulnerable_entry is None:
+                journal.record(entry, VULNERABLE_NOT_FOUND)
                 continue
             
             # checkout to non-vulnerable
-            cloner.checkout_to_benign(entry["commit_id"])
-            benign_entry = process(vulnerable_function, cloner, chunker, project_name, commit_id)
+            if cloner is not None:
+                with metrics.stage("checkout"):
+                    checked_out = cloner.checkout_to_benign(entry["commit_id"])
+                if not checked_out:
+                    journal.record(entry, FETCH_FAILED)
+                    continue
+            benign_entry = process(vulnerable_function, cloner, chunker, project_name, commit_id, diff_scoped, commit_id, targeted, pool)
             
             if benign_entry is None:
+                journal.record(entry, BENIGN_NOT_FOUND)
                 continue
             # extract functions calling the vulnerable function
             # extract bodies of caller functions
@@ -176,17 +288,35 @@ def main():
             # construct json object
             # write to the jsonl file
             
-            entry = {
+            paired_entry = {
                 "vulnerable" : vulnerable_entry,
                 "benign" : benign_entry
             }
             
-            with open("paired.jsonl", 'a') as file:
-                file.write(json.dumps(entry) + "\n")
+            # journaled once its batch is on disk, a crash before that only redoes the batch;
+            # the bodies it points to are on disk before it is
+            pool.flush()
+            writer.write(paired_entry, shard=project_name, on_flush=lambda entry=entry: journal.record(entry, PAIRED))
         except KeyboardInterrupt as e:
             print("\nlast index:", idx)
+            pool.close()
+            writer.close()
+            journal.close()
             raise e
-            
+        except Exception as e:
+            # logged and moved past, an unattended run must not stop on one bad entry
+            print(f"entry {idx} ({entry.get('project')} {entry.get('commit_id')}) failed: {e!r}", file=sys.stderr)
+            journal.record(entry, ERROR, repr(e))
+        finally:
+            metrics.end_entry()
+            if profiler is not None:
+                stop_profile(profiler, profile_path)
+    
+    pool.close()
+    writer.close()
+    journal.close()
+    if metrics_path is not None:
+        metrics.dump(metrics_path)
         
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,78 @@
+import os
+import threading
+from tree_sitter_languages import get_parser
+from extract import QueryExtractor
+from metrics import metrics
+
+LANGUAGES = {
+    '.py': 'python',
+    '.js': 'javascript',
+    '.java': 'java',
+    '.cpp': 'cpp',
+    '.cc': 'cpp',
+    '.c': 'c',
+    '.h': 'c',
+    '.cs': 'c_sharp',
+}
+
+# all PrimeVul has, for Chunker(languages=...)
+C_FAMILY = ('c', 'cpp')
+
+
+def extensions(languages=None) -> dict:
+    # LANGUAGES cut down to the given language names, all of it for None
+    if languages is None:
+        return dict(LANGUAGES)
+    unknown = set(languages) - set(LANGUAGES.values())
+    if unknown:
+        raise ValueError(f"unknown languages: {', '.join(sorted(unknown))}")
+    return {ext: language for ext, language in LANGUAGES.items() if language in languages}
+
+
+# Tree-sitter parsers and query extractors, loaded the first time a language is asked for
+# and reused by every Chunker after that.
+#
+# Parsers aren't thread safe, so each thread has its own. A forked process (a pool worker)
+# starts over with none rather than use copies of its parent's, and builds what it needs
+# once. Parsers are per parse timeout too, set once when built, so a Chunker with a timeout
+# never changes the one another Chunker is parsing with.
+class ParserRegistry:
+    def __init__(self):
+        self.__local = threading.local()
+
+    def __cache(self):
+        local = self.__local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.pid = os.getpid()
+            local.parsers = dict()
+            local.extractors = dict()
+        return local
+
+    def parser(self, language : str, timeout_micros : int = 0):
+        cache = self.__cache()
+        key = (language, timeout_micros)
+        parser = cache.parsers.get(key)
+        if parser is None:
+            with metrics.stage("load_grammar"):
+                parser = get_parser(language)
+            if timeout_micros:
+                parser.set_timeout_micros(timeout_micros)
+            cache.parsers[key] = parser
+        return parser
+
+    def extractor(self, language : str, timeout_micros : int = 0) -> QueryExtractor:
+        cache = self.__cache()
+        key = (language, timeout_micros)
+        extractor = cache.extractors.get(key)
+        if extractor is None:
+            parser = self.parser(language, timeout_micros)
+            with metrics.stage("load_grammar"):
+                extractor = cache.extractors[key] = QueryExtractor(language, parser)
+        return extractor
+
+    def loaded(self) -> list:
+        # the (language, timeout) pairs this thread has a parser for
+        return list(self.__cache().parsers)
+
+
+registry = ParserRegistry()
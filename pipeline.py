@@ -0,0 +1,320 @@
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from cache import ParseCache
+from clone import RepositoryCache
+from ingest import stream_entries_by_project
+from output import ShardedWriter
+from metrics import metrics
+from journal import ProgressJournal, PAIRED, NO_URL, FETCH_FAILED, VULNERABLE_NOT_FOUND, BENIGN_NOT_FOUND, ERROR
+from pairwise import assemble, load_mapping_json, normalize_function_body
+from pool import FunctionPool
+from split import Chunker
+from store import FunctionStore
+
+# Staged version of pairwise.main. Entries flow through
+#
+#   fetch (threads: mirror fetch, one worktree per revision)
+#   -> parse (threads feeding a process pool, one task parses both revisions)
+#   -> match (threads: find the function, assemble callers and callees)
+#   -> writer (one thread, writes in input order)
+#
+# connected by bounded queues. At most max_in_flight entries are between the feeder and
+# the writer at any time, which bounds the worktrees on disk, the parsed data in memory
+# and the writer's reorder buffer. The output is the same as pairwise.main's, in the same order,
+# except with from_git: files then come in git's sorted path order instead of the directory
+# walk's, so the same entries are found but lists built in file order (callers) can differ.
+
+_DONE = object()
+
+_chunker = None
+
+
+def _init_parse_worker(store_path):
+    global _chunker
+    store = FunctionStore(store_path) if store_path is not None else None
+    # a FunctionTable pickles as a few arrays, with each path and callee name once, on its way back
+    _chunker = Chunker(cache=ParseCache(), store=store, compact=True)
+
+
+def _parse_revisions(project, revisions, display_path, from_git=False):
+    # both revisions in one task, so the second reuses the first's parse cache
+    return [_chunker.read_and_parse_commit(path, project, revision, display_path=display_path, from_git=from_git) for path, revision in revisions]
+
+
+class _Stage:
+    # workers threads running handle() on every item of in_queue; when the last one
+    # is done, every worker of the next stage gets a _DONE. Items handle() fails on
+    # go to fail(), so the writer still hears about every entry
+    def __init__(self, name, handle, in_queue, workers, fail):
+        self.name = name
+        self.handle = handle
+        self.fail = fail
+        self.in_queue = in_queue
+        self.workers = workers
+        self.next_queue = None
+        self.next_workers = 0
+        self.__running = workers
+        self.__lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.__work, name=f"{name}-{idx}", daemon=True) for idx in range(workers)]
+
+    def then(self, next_stage):
+        self.next_queue = next_stage.in_queue
+        self.next_workers = next_stage.workers
+        return next_stage
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def __work(self):
+        while True:
+            item = self.in_queue.get()
+            if item is _DONE:
+                break
+            try:
+                with metrics.stage(self.name):
+                    self.handle(item)
+            except Exception as e:
+                print(f"{self.name} failed:", repr(e), file=sys.stderr)
+                self.fail(item, e)
+
+        with self.__lock:
+            self.__running -= 1
+            last = self.__running == 0
+        if last and self.next_queue is not None:
+            for _ in range(self.next_workers):
+                self.next_queue.put(_DONE)
+
+
+class PairingPipeline:
+    def __init__(self, mapping : dict, output_path : str = "paired.jsonl", fetch_workers : int = 2, parse_workers : int = None,
+                 match_workers : int = 2, queue_size : int = 4, max_in_flight : int = None,
+                 repository_cache : RepositoryCache = None, store_path : str = "functions.sqlite", journal : ProgressJournal = None,
+                 batch_size : int = 32, from_git : bool = False):
+        # from_git parses both revisions straight out of the project's mirror, no worktrees,
+        # in git's path order (see above)
+        self.mapping = mapping
+        self.from_git = from_git
+        self.output_path = output_path
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.match_workers = match_workers
+        self.queue_size = queue_size
+        self.max_in_flight = max_in_flight or (fetch_workers + self.parse_workers + match_workers + 3 * queue_size)
+        self.repository_cache = repository_cache if repository_cache is not None else RepositoryCache()
+        self.store_path = store_path
+        self.batch_size = batch_size
+
+        self.journal = journal
+        self.written = 0
+        self.skipped = 0
+        self.resumed = 0
+        self.__store = threading.local()
+        # similarity memo only, the match threads share it; bodies are written inline
+        self.__pool = FunctionPool(normalize_function_body)
+
+    def __function_store(self):
+        # sqlite connections can't be shared between threads
+        if self.store_path is None:
+            return None
+        store = getattr(self.__store, 'store', None)
+        if store is None:
+            store = self.__store.store = FunctionStore(self.store_path)
+        return store
+
+    def __fetch(self, item):
+        idx, entry = item
+        project_name = entry["project"]
+        commit_id = entry["commit_id"]
+        url = self.mapping.get(project_name)
+        if url is None:
+            self.__write_queue.put((idx, entry, None, NO_URL, None))
+            return
+
+        revisions = [f"{commit_id}^", commit_id]
+        store = self.__function_store()
+        if store is not None and all(store.has(project_name, revision) for revision in revisions):
+            # parsed by an earlier run, no git needed
+            self.__parse_queue.put((idx, entry, [(None, revision) for revision in revisions], []))
+            return
+
+        # entries come project by project, the worktrees of the ones before aren't needed anymore
+        self.repository_cache.remove_released_worktrees(keep=project_name)
+        worktrees = []
+        with self.repository_cache.lock(project_name):
+            ok = self.repository_cache.ensure_mirror(project_name, url, commit_id)
+            if ok and self.from_git:
+                # the parse reads the mirror itself, objects are never removed from it so that's safe
+                revisions = [(self.repository_cache.mirror_path(project_name), revision) for revision in revisions]
+            elif ok:
+                # worktrees the project's earlier entries are done with, switched over incrementally
+                for revision in revisions:
+                    path = self.repository_cache.lease_worktree(project_name, revision)
+                    if path is None:
+                        ok = False
+                        break
+                    worktrees.append(path)
+                revisions = list(zip(worktrees, revisions))
+
+        if not ok:
+            self.__release_worktrees(project_name, worktrees)
+            self.__write_queue.put((idx, entry, None, FETCH_FAILED, None))
+            return
+        self.__parse_queue.put((idx, entry, revisions, worktrees))
+
+    def __release_worktrees(self, project_name, worktrees):
+        if not worktrees:
+            return
+        with self.repository_cache.lock(project_name):
+            for path in worktrees:
+                self.repository_cache.release_worktree(project_name, path)
+
+    def __parse(self, item):
+        idx, entry, revisions, worktrees = item
+        try:
+            # file paths are reported as if parsed in the project's usual worktree, like pairwise.main does
+            display_path = self.repository_cache.worktree_path(entry["project"])
+            vulnerable_data, benign_data = self.__executor.submit(_parse_revisions, entry["project"], revisions, display_path, self.from_git).result()
+        except Exception as e:
+            print("Couldn't parse", entry["project"], entry["commit_id"], e)
+            self.__write_queue.put((idx, entry, None, ERROR, repr(e)))
+            return
+        finally:
+            self.__release_worktrees(entry["project"], worktrees)
+        self.__match_queue.put((idx, entry, vulnerable_data, benign_data))
+
+    def __match(self, item):
+        idx, entry, vulnerable_data, benign_data = item
+        project_name = entry["project"]
+        commit_id = entry["commit_id"]
+        vulnerable_function = entry["func"]
+
+        vulnerable_entry = assemble(vulnerable_data, vulnerable_function, project_name, commit_id, pool=self.__pool)
+        if vulnerable_entry is None:
+            self.__write_queue.put((idx, entry, None, VULNERABLE_NOT_FOUND, None))
+            return
+        benign_entry = assemble(benign_data, vulnerable_function, project_name, commit_id, pool=self.__pool)
+        if benign_entry is None:
+            self.__write_queue.put((idx, entry, None, BENIGN_NOT_FOUND, None))
+            return
+        result = {
+            "vulnerable" : vulnerable_entry,
+            "benign" : benign_entry
+        }
+        self.__write_queue.put((idx, entry, result, PAIRED, None))
+
+    def __journal(self, entry, outcome, detail=None):
+        if self.journal is not None:
+            self.journal.record(entry, outcome, detail)
+
+    def __write(self):
+        # results come back out of order, hold them until every earlier entry is written
+        pending = dict()
+        next_idx = 0
+        with ShardedWriter(self.output_path, mode="a", batch_size=self.batch_size) as writer:
+            while True:
+                item = self.__write_queue.get()
+                if item is _DONE:
+                    break
+                idx, entry, result, outcome, detail = item
+                pending[idx] = (entry, result, outcome, detail)
+
+                while next_idx in pending:
+                    entry, result, outcome, detail = pending.pop(next_idx)
+                    next_idx += 1
+                    if result is None:
+                        self.skipped += 1
+                        self.__journal(entry, outcome, detail)
+                    else:
+                        # journaled once its batch is on disk, a crash before that only redoes the batch
+                        writer.write(result, shard=entry["project"], on_flush=lambda entry=entry, outcome=outcome: self.__journal(entry, outcome))
+                        self.written += 1
+                    self.__in_flight.release()
+
+    def run(self, entries) -> dict:
+        self.__fetch_queue = queue.Queue(self.queue_size)
+        self.__parse_queue = queue.Queue(self.queue_size)
+        self.__match_queue = queue.Queue(self.queue_size)
+        # not bounded, max_in_flight already bounds what can be in it
+        self.__write_queue = queue.Queue()
+        self.__in_flight = threading.BoundedSemaphore(self.max_in_flight)
+
+        # every stage's items start with (idx, entry, ...)
+        fail = lambda item, e: self.__write_queue.put((item[0], item[1], None, ERROR, repr(e)))
+        fetch = _Stage("fetch", self.__fetch, self.__fetch_queue, self.fetch_workers, fail)
+        parse = _Stage("parse", self.__parse, self.__parse_queue, self.parse_workers, fail)
+        match = _Stage("match", self.__match, self.__match_queue, self.match_workers, fail)
+        fetch.then(parse).then(match)
+        match.next_queue = self.__write_queue
+        match.next_workers = 1
+        writer = threading.Thread(target=self.__write, name="writer", daemon=True)
+
+        start = time.perf_counter()
+        # forking a pool worker while a fetch thread is starting git would leave the worker
+        # holding that subprocess's pipes and hang it, so workers come from a fork server
+        mp_context = multiprocessing.get_context("forkserver")
+        with ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=mp_context, initializer=_init_parse_worker, initargs=(self.store_path,)) as executor:
+            self.__executor = executor
+            for stage in (fetch, parse, match):
+                stage.start()
+            writer.start()
+
+            count = 0
+            idx = 0
+            for entry in entries:
+                if self.journal is not None and self.journal.done(entry):
+                    self.resumed += 1
+                    continue
+                self.__in_flight.acquire()
+                self.__fetch_queue.put((idx, entry))
+                idx += 1
+                count += 1
+            for _ in range(self.fetch_workers):
+                self.__fetch_queue.put(_DONE)
+
+            writer.join()
+        self.repository_cache.remove_released_worktrees()
+
+        elapsed = time.perf_counter() - start
+        return {
+            "entries": count,
+            "written": self.written,
+            "skipped": self.skipped,
+            "resumed": self.resumed,
+            "seconds": elapsed,
+            "entries_per_hour": count / elapsed * 3600 if elapsed else 0.0,
+        }
+
+
+def main(fetch_workers : int = 2, parse_workers : int = None, match_workers : int = 2, queue_size : int = 4,
+         resume : bool = False, journal_path : str = "progress.jsonl", metrics_path : str = None, from_git : bool = False):
+    # with metrics_path, the time spent in each stage (and the git, match and write timers
+    # under it) is dumped there; parsing happens in the pool, its per-file times aren't seen here
+    if metrics_path is not None:
+        metrics.enable()
+    journal = ProgressJournal(journal_path, resume=resume)
+    pipeline = PairingPipeline(
+        load_mapping_json(),
+        fetch_workers=fetch_workers,
+        parse_workers=parse_workers,
+        match_workers=match_workers,
+        queue_size=queue_size,
+        journal=journal,
+        from_git=from_git,
+    )
+    try:
+        stats = pipeline.run(stream_entries_by_project(target=1))
+    finally:
+        journal.close()
+    print(stats)
+    if metrics_path is not None:
+        metrics.dump(metrics_path)
+
+
+if __name__ == '__main__':
+    main()
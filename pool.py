@@ -0,0 +1,118 @@
+import hashlib
+import os
+import orjson
+from metrics import metrics
+from output import ShardedWriter
+from similarity import TargetMatcher
+
+
+def _digest(text : str) -> str:
+    return hashlib.blake2b(text.encode('utf-8', errors='replace'), digest_size=16).hexdigest()
+
+
+def load_pool(path : str) -> dict:
+    # body id -> body, for readers of records that reference pooled bodies
+    bodies = dict()
+    if not os.path.exists(path):
+        return bodies
+    with open(path, 'rb') as file:
+        for line in file:
+            try:
+                record = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue
+            bodies[record["id"]] = record["function_body"]
+    return bodies
+
+
+# Function bodies by content, shared by every parse of a run.
+#
+# Similarity is memoized per (body, target) pair, keyed by hashes of the normalized texts,
+# so a body that shows up again (the other revision of the fix, the next entry of the same
+# project) is never compared with the same target twice. With a path, add() also writes
+# every distinct body once to that JSONL file and hands back its id for records to point to.
+# Ids there hash the body as it is, not normalized, so references give back the exact text.
+class FunctionPool:
+    def __init__(self, normalize=None, threshold : float = 0.9, path : str = None, max_pairs : int = 4000000):
+        self.normalize = normalize if normalize is not None else (lambda body: body)
+        self.threshold = threshold
+        self.path = path
+        self.max_pairs = max_pairs
+
+        self.__similar = dict()
+        self.__stored = set()
+        self.__writer = None
+        if path is not None:
+            with open(path, 'ab'):
+                pass
+            line = b"\n"
+            with open(path, 'rb') as file:
+                for line in file:
+                    try:
+                        self.__stored.add(orjson.loads(line)["id"])
+                    except orjson.JSONDecodeError:
+                        # torn by a crash, the body is written again when next seen
+                        continue
+            if not line.endswith(b"\n"):
+                # so the next body starts on a line of its own
+                with open(path, 'ab') as file:
+                    file.write(b"\n")
+            self.__writer = ShardedWriter(path, mode="a")
+
+    def key(self, function_body : str) -> str:
+        return _digest(self.normalize(function_body))
+
+    def matcher(self, target : str):
+        return _PooledMatcher(self, target)
+
+    def find(self, data, target : str) -> list:
+        # the entries similar to target, the same as find_vulnerable_function
+        matcher = self.matcher(target)
+        return [entry for entry in data if matcher.matches_body(entry[3])]
+
+    def similarity(self, body_key, target_key):
+        return self.__similar.get((body_key, target_key))
+
+    def remember(self, body_key, target_key, similar : bool) -> None:
+        if len(self.__similar) >= self.max_pairs:
+            # cheaper than an LRU, and a run rarely gets here
+            self.__similar.clear()
+        self.__similar[(body_key, target_key)] = similar
+
+    def add(self, function_body : str) -> str:
+        body_id = _digest(function_body)
+        if self.__writer is not None and body_id not in self.__stored:
+            self.__stored.add(body_id)
+            self.__writer.write({"id": body_id, "function_body": function_body})
+        return body_id
+
+    def flush(self) -> None:
+        if self.__writer is not None:
+            self.__writer.flush()
+
+    def close(self) -> None:
+        if self.__writer is not None:
+            self.__writer.close()
+
+
+class _PooledMatcher:
+    def __init__(self, pool, target):
+        self.pool = pool
+        self.target = target
+        self.target_key = pool.key(target)
+        self.__matcher = None
+
+    def matches_body(self, function_body : str) -> bool:
+        pool = self.pool
+        body_key = pool.key(function_body)
+        similar = pool.similarity(body_key, self.target_key)
+        if similar is not None:
+            metrics.count("pool_hits")
+            return similar
+
+        metrics.count("pool_misses")
+        if self.__matcher is None:
+            self.__matcher = TargetMatcher(self.target, pool.normalize, pool.threshold)
+        similar = self.__matcher.matches_body(function_body)
+        pool.remember(body_key, self.target_key, similar)
+        return similar
@@ -0,0 +1,266 @@
+import mmap
+import os
+from array import array
+from collections import OrderedDict
+from collections.abc import Sequence
+
+# how many memory-mapped source files stay open at once
+MAX_OPEN_FILES = 64
+
+_open_maps = OrderedDict()
+
+
+# A parsed source file that function bodies are sliced out of on demand.
+# The size and mtime at parse time are kept so a file changed since
+# (say by a checkout) is reported instead of giving back wrong bodies.
+class SourceFile:
+    __slots__ = ('path', 'size', 'mtime_ns')
+
+    def __init__(self, path : str):
+        self.path = path
+        stat = os.stat(path)
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+
+    def __map(self):
+        mapped = _open_maps.get(self)
+        if mapped is not None:
+            _open_maps.move_to_end(self)
+            return mapped
+
+        stat = os.stat(self.path)
+        if stat.st_size != self.size or stat.st_mtime_ns != self.mtime_ns:
+            raise ValueError(f"{self.path} changed since it was parsed")
+
+        with open(self.path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _open_maps[self] = mapped
+        while len(_open_maps) > MAX_OPEN_FILES:
+            _, evicted = _open_maps.popitem(last=False)
+            evicted.close()
+        return mapped
+
+    def read(self, start_byte : int, end_byte : int) -> bytes:
+        if start_byte == end_byte:
+            return b''
+        return self.__map()[start_byte:end_byte]
+
+
+def close_all() -> None:
+    while _open_maps:
+        _, mapped = _open_maps.popitem()
+        mapped.close()
+
+
+# One function found by Chunker.iter_records. The body stays in the file until
+# function_body is read. Unpacks like the (file_path, signature, callees, body)
+# tuples the rest of the pipeline uses, so it can be passed wherever those go.
+class FunctionRecord:
+    __slots__ = ('source', 'function_signature', 'callees', 'start_byte', 'end_byte')
+
+    def __init__(self, source : SourceFile, function_signature : str, callees : list, start_byte : int, end_byte : int):
+        self.source = source
+        self.function_signature = function_signature
+        self.callees = callees
+        self.start_byte = start_byte
+        self.end_byte = end_byte
+
+    @property
+    def file_path(self) -> str:
+        return self.source.path
+
+    @property
+    def byte_length(self) -> int:
+        return self.end_byte - self.start_byte
+
+    @property
+    def function_body(self) -> str:
+        return self.source.read(self.start_byte, self.end_byte).decode('utf-8', errors='replace')
+
+    def as_tuple(self) -> tuple:
+        return (self.file_path, self.function_signature, self.callees, self.function_body)
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    def __len__(self):
+        return 4
+
+    def __getitem__(self, idx):
+        if idx == 0:
+            return self.file_path
+        if idx == 1:
+            return self.function_signature
+        if idx == 2:
+            return self.callees
+        if idx == 3 or idx == -1:
+            return self.function_body
+        return self.as_tuple()[idx]
+
+    def __repr__(self):
+        return f"FunctionRecord({self.file_path!r}, {self.function_signature!r}, {self.start_byte}, {self.end_byte})"
+
+
+# Names kept once, handed out as small integer ids in the order they were first seen.
+class Interner:
+    __slots__ = ('names', 'ids')
+
+    def __init__(self):
+        self.names = []
+        self.ids = dict()
+
+    def id(self, name : str) -> int:
+        idx = self.ids.get(name)
+        if idx is None:
+            idx = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return idx
+
+    def __getitem__(self, idx : int) -> str:
+        return self.names[idx]
+
+    def __len__(self):
+        return len(self.names)
+
+
+# Parse results stored by column instead of one tuple per function: file paths and callee
+# names are interned, each function's callees are a run of integer ids in one array (its
+# run starts at callee_starts[idx]), and only signatures and bodies are kept as strings.
+# Indexing gives a FunctionRow, which unpacks like the (file_path, signature, callees, body)
+# tuples, so a table can go wherever a list of those does. It pickles as a handful of arrays.
+class FunctionTable(Sequence):
+    __slots__ = ('paths', 'names', 'path_ids', 'signatures', 'callee_starts', 'callee_ids', 'bodies')
+
+    def __init__(self, data=()):
+        self.paths = Interner()
+        self.names = Interner()
+        self.path_ids = array('I')
+        self.signatures = []
+        self.callee_starts = array('I', [0])
+        self.callee_ids = array('I')
+        self.bodies = []
+        self.extend(data)
+
+    def append(self, file_path : str, function_signature : str, callees : list, function_body : str) -> None:
+        self.path_ids.append(self.paths.id(file_path))
+        self.signatures.append(function_signature)
+        self.callee_ids.extend(self.names.id(callee) for callee in callees)
+        self.callee_starts.append(len(self.callee_ids))
+        self.bodies.append(function_body)
+
+    def extend(self, data) -> None:
+        for entry in data:
+            self.append(*entry)
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [FunctionRow(self, i) for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("function index out of range")
+        return FunctionRow(self, idx)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield FunctionRow(self, idx)
+
+    def __add__(self, other):
+        table = FunctionTable(self)
+        table.extend(other)
+        return table
+
+    def file_path(self, idx : int) -> str:
+        return self.paths[self.path_ids[idx]]
+
+    def callee_id_run(self, idx : int) -> array:
+        return self.callee_ids[self.callee_starts[idx]:self.callee_starts[idx + 1]]
+
+    def callees(self, idx : int) -> list:
+        names = self.names.names
+        return [names[callee_id] for callee_id in self.callee_id_run(idx)]
+
+    def replace_path_prefix(self, old : str, new : str) -> None:
+        # every path starting with old now starts with new, at the cost of one string per file
+        paths = Interner()
+        for path in self.paths.names:
+            paths.id(new + path[len(old):] if path.startswith(old) else path)
+        self.paths = paths
+
+    def as_tuples(self) -> list:
+        return [row.as_tuple() for row in self]
+
+    def __getstate__(self):
+        # the interners' dicts are rebuilt from their name lists on the other side
+        return (self.paths.names, self.names.names, self.path_ids, self.signatures, self.callee_starts, self.callee_ids, self.bodies)
+
+    def __setstate__(self, state):
+        paths, names, self.path_ids, self.signatures, self.callee_starts, self.callee_ids, self.bodies = state
+        self.paths = Interner()
+        self.names = Interner()
+        for path in paths:
+            self.paths.id(path)
+        for name in names:
+            self.names.id(name)
+
+
+# One function of a FunctionTable, a view that reads its columns when asked.
+class FunctionRow:
+    __slots__ = ('table', 'idx')
+
+    def __init__(self, table : FunctionTable, idx : int):
+        self.table = table
+        self.idx = idx
+
+    @property
+    def file_path(self) -> str:
+        return self.table.file_path(self.idx)
+
+    @property
+    def function_signature(self) -> str:
+        return self.table.signatures[self.idx]
+
+    @property
+    def callees(self) -> list:
+        return self.table.callees(self.idx)
+
+    @property
+    def callee_ids(self) -> array:
+        return self.table.callee_id_run(self.idx)
+
+    @property
+    def function_body(self) -> str:
+        return self.table.bodies[self.idx]
+
+    def as_tuple(self) -> tuple:
+        return (self.file_path, self.function_signature, self.callees, self.function_body)
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    def __len__(self):
+        return 4
+
+    def __getitem__(self, idx):
+        if idx == 0:
+            return self.file_path
+        if idx == 1:
+            return self.function_signature
+        if idx == 2:
+            return self.callees
+        if idx == 3 or idx == -1:
+            return self.function_body
+        return self.as_tuple()[idx]
+
+    def __eq__(self, other):
+        if isinstance(other, (tuple, FunctionRow, FunctionRecord)):
+            return self.as_tuple() == tuple(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"FunctionRow({self.file_path!r}, {self.function_signature!r})"
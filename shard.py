@@ -0,0 +1,137 @@
+import argparse
+import heapq
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import orjson
+import pairwise
+from ingest import project_order
+
+# Sharded pairing run. Every project goes to one shard, by a stable hash of its name
+# (ingest.project_shard), so its mirror, worktree and parses stay on one node. A node runs
+# pairwise.main over its shard only, writing its own part, journal and function store:
+#
+#   python shard.py node 3 8        # on each host (or process), shards 0..7
+#   python shard.py merge 8         # once every part is in one directory
+#   python shard.py local 8         # all of it with local processes as the nodes
+#
+# Each part has its projects in the canonical order, so merge only interleaves whole
+# projects and the merged file is what a single pairwise.main run writes.
+#
+# A node's store only ever holds its own projects, so the nodes don't share one sqlite file
+# and wait on each other's writes. A rerun with the same shards finds its parses again.
+
+
+def part_path(output_path : str, shard : int, shards : int) -> str:
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.part-{shard:04d}-of-{shards:04d}{ext}"
+
+
+def run_node(shard : int, shards : int, output_path : str = "paired.jsonl", journal_path : str = "progress.jsonl",
+             resume : bool = False, store_path : str = "functions.sqlite", **options) -> None:
+    if not 0 <= shard < shards:
+        raise ValueError(f"shard {shard} out of {shards}")
+    # there even if the shard has no entries, merge tells a missing part from an empty one
+    open(part_path(output_path, shard, shards), 'ab').close()
+    pairwise.main(
+        resume=resume,
+        journal_path=part_path(journal_path, shard, shards),
+        output_path=part_path(output_path, shard, shards),
+        store_path=part_path(store_path, shard, shards),
+        shard=shard,
+        shards=shards,
+        **options
+    )
+
+
+def _read_part(path, rank):
+    # (project rank, line) for every line of the part, checking the projects come in order
+    last = -1
+    with open(path, 'rb') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            project = orjson.loads(line)["vulnerable"]["project"]
+            project_rank = rank.get(project)
+            if project_rank is None:
+                raise ValueError(f"{path}: project {project} isn't in the dataset")
+            if project_rank < last:
+                raise ValueError(f"{path}: project {project} is out of order, was the part appended to by another run?")
+            last = project_rank
+            yield project_rank, line
+
+
+def merge(shards : int, output_path : str = "paired.jsonl") -> int:
+    # the parts in canonical order, written to output_path in one go; returns the number of lines
+    rank = {project: idx for idx, project in enumerate(project_order(target=1))}
+    paths = [part_path(output_path, shard, shards) for shard in range(shards)]
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"missing parts: {', '.join(missing)}")
+
+    lines = 0
+    tmp_path = f"{output_path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as out:
+        # a project is only ever in one part, so the merge never splits one up
+        for _, line in heapq.merge(*(_read_part(path, rank) for path in paths), key=lambda item: item[0]):
+            out.write(line if line.endswith(b"\n") else line + b"\n")
+            lines += 1
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, output_path)
+    return lines
+
+
+def run_local(shards : int, processes : int = None, output_path : str = "paired.jsonl", resume : bool = False, **options) -> int:
+    # every shard in its own process, at most processes at a time, then the merge
+    processes = processes or shards
+    context = multiprocessing.get_context("spawn")
+    pending = list(range(shards))
+    running = []
+    failed = []
+    while pending or running:
+        while pending and len(running) < processes:
+            shard = pending.pop(0)
+            process = context.Process(target=run_node, args=(shard, shards, output_path), kwargs=dict(resume=resume, **options), name=f"shard-{shard}")
+            process.start()
+            running.append((shard, process))
+        # refill as soon as any node is done, not just the oldest
+        done = wait([process.sentinel for _, process in running])
+        for shard, process in [item for item in running if item[1].sentinel in done]:
+            process.join()
+            running.remove((shard, process))
+            if process.exitcode != 0:
+                failed.append(shard)
+
+    if failed:
+        raise RuntimeError(f"shards {failed} failed, rerun them with resume before merging")
+    return merge(shards, output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sharded pairing run")
+    commands = parser.add_subparsers(dest="command", required=True)
+    node = commands.add_parser("node", help="run one shard")
+    node.add_argument("shard", type=int)
+    node.add_argument("shards", type=int)
+    node.add_argument("--resume", action="store_true")
+    merged = commands.add_parser("merge", help="merge the parts")
+    merged.add_argument("shards", type=int)
+    local = commands.add_parser("local", help="run every shard as a local process, then merge")
+    local.add_argument("shards", type=int)
+    local.add_argument("--processes", type=int)
+    local.add_argument("--resume", action="store_true")
+    for command in (node, merged, local):
+        command.add_argument("--output", default="paired.jsonl")
+    args = parser.parse_args()
+
+    if args.command == "node":
+        run_node(args.shard, args.shards, args.output, resume=args.resume)
+    elif args.command == "merge":
+        print("merged", merge(args.shards, args.output), "entries into", args.output)
+    else:
+        print("merged", run_local(args.shards, args.processes, args.output, resume=args.resume), "entries into", args.output)
+
+
+if __name__ == '__main__':
+    main()
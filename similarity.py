@@ -0,0 +1,139 @@
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from difflib import SequenceMatcher
+from metrics import metrics
+
+
+def _upper_bound(matches, total):
+    # same formula SequenceMatcher.ratio uses, so the bound compares exactly like the ratio would
+    return 2.0 * matches / total if total else 1.0
+
+
+def _length_bounds(length, threshold):
+    # lengths that could still reach the threshold, with a little slack for rounding
+    if threshold <= 0:
+        return 0, float('inf')
+    low = int(threshold * length / (2 - threshold)) - 1
+    high = int(length * (2 - threshold) / threshold) + 1
+    return low, high
+
+
+# Finds the functions of a parsed repo whose SequenceMatcher ratio against a target
+# is above the threshold, giving the same answers as comparing against every one.
+#
+# Every body is normalized once when the index is built. A query only runs the exact
+# ratio on the candidates that survive two cheap upper bounds on it: the length of the
+# bodies (a length window found with bisect) and the overlap of their character counts
+# (what SequenceMatcher.quick_ratio computes). Neither bound can reject a real match.
+class SimilarityIndex:
+    def __init__(self, data, normalize=None, threshold : float = 0.9):
+        self.data = data
+        self.normalize = normalize if normalize is not None else (lambda body: body)
+        self.threshold = threshold
+
+        self.bodies = [self.normalize(entry[3]) for entry in data]
+        self.__char_counts = [None] * len(self.bodies)
+
+        # indices of the bodies sorted by length, for the length window
+        self.__by_length = sorted(range(len(self.bodies)), key=lambda idx: len(self.bodies[idx]))
+        self.__lengths = [len(self.bodies[idx]) for idx in self.__by_length]
+
+    def __char_count(self, idx):
+        counts = self.__char_counts[idx]
+        if counts is None:
+            counts = self.__char_counts[idx] = Counter(self.bodies[idx])
+        return counts
+
+    def __length_window(self, length):
+        low, high = _length_bounds(length, self.threshold)
+        return bisect_left(self.__lengths, low), bisect_right(self.__lengths, high)
+
+    def candidates(self, target : str) -> list:
+        target = self.normalize(target)
+        target_length = len(target)
+        target_counts = None
+
+        start, end = self.__length_window(target_length)
+        candidates = []
+        for idx in self.__by_length[start:end]:
+            length = len(self.bodies[idx])
+            total = length + target_length
+            if _upper_bound(min(length, target_length), total) <= self.threshold:
+                continue
+
+            if target_counts is None:
+                target_counts = Counter(target)
+            if _upper_bound(sum((self.__char_count(idx) & target_counts).values()), total) <= self.threshold:
+                continue
+            candidates.append(idx)
+
+        candidates.sort()
+        if metrics.enabled:
+            metrics.count("match_considered", end - start)
+            metrics.count("match_candidates", len(candidates))
+        return candidates
+
+    def find_indices(self, target : str) -> list:
+        # the target goes in as the second sequence, like the linear scan did,
+        # so SequenceMatcher only indexes it once for every candidate
+        matcher = SequenceMatcher(None)
+        matcher.set_seq2(self.normalize(target))
+
+        matches = []
+        with metrics.stage("match"):
+            candidates = self.candidates(target)
+            for idx in candidates:
+                matcher.set_seq1(self.bodies[idx])
+                if matcher.ratio() > self.threshold:
+                    matches.append(idx)
+        metrics.count("comparisons", len(candidates))
+        return matches
+
+    def find(self, target : str) -> list:
+        return [self.data[idx] for idx in self.find_indices(target)]
+
+
+# Checks entries one at a time against a single target, with the same bounds and the same
+# answers as SimilarityIndex, but without keeping any body around. Records that know their
+# size in bytes (FunctionRecord.byte_length) are skipped before their body is even read when
+# they are too short to match, normalizing never makes a body longer than its bytes.
+class TargetMatcher:
+    def __init__(self, target : str, normalize=None, threshold : float = 0.9):
+        self.normalize = normalize if normalize is not None else (lambda body: body)
+        self.threshold = threshold
+        self.target = self.normalize(target)
+        self.low, self.high = _length_bounds(len(self.target), threshold)
+
+        self.__target_counts = None
+        self.__matcher = SequenceMatcher(None)
+        self.__matcher.set_seq2(self.target)
+
+    def matches(self, entry) -> bool:
+        byte_length = getattr(entry, 'byte_length', None)
+        if byte_length is not None and byte_length < self.low:
+            return False
+        return self.matches_body(entry[3])
+
+    def matches_body(self, function_body : str) -> bool:
+        body = self.normalize(function_body)
+        length = len(body)
+        total = length + len(self.target)
+        if length < self.low or length > self.high or _upper_bound(min(length, len(self.target)), total) <= self.threshold:
+            return False
+
+        if self.__target_counts is None:
+            self.__target_counts = Counter(self.target)
+        if _upper_bound(sum((Counter(body) & self.__target_counts).values()), total) <= self.threshold:
+            return False
+
+        metrics.count("comparisons")
+        self.__matcher.set_seq1(body)
+        return self.__matcher.ratio() > self.threshold
+
+
+def find_similar(data, target : str, normalize=None, threshold : float = 0.9):
+    # streaming counterpart of SimilarityIndex.find, yields the matching entries as they go by
+    matcher = TargetMatcher(target, normalize, threshold)
+    for entry in data:
+        if matcher.matches(entry):
+            yield entry
@@ -1,36 +1,146 @@
 
-from tree_sitter import Parser
-from tree_sitter_languages import get_parser
+from concurrent.futures import ProcessPoolExecutor
 import os 
+import re
+import time
+from cache import ParseCache
+from gitsource import GitTree
+from lexindex import IdentifierIndex
+from metrics import metrics
+from parsers import LANGUAGES, extensions, registry
+from records import FunctionRecord, FunctionTable, SourceFile
+from store import FunctionStore
+
+# never descended into, whatever exclude_dirs says
+VCS_DIRS = ('.git', '.hg', '.svn')
+# common names for code that isn't the project's own, for exclude_dirs
+VENDOR_DIRS = ('vendor', 'third_party', 'thirdparty', '3rdparty', 'external', 'deps')
+TEST_DIRS = ('test', 'tests', 'testing')
+# generated or amalgamated sources (sqlite3.c is ~9MB) cost more than all the rest of a repo
+MAX_FILE_SIZE = 4 * 1024 * 1024
+
+# each pool worker builds its own Chunker once, on start up, and loads grammars as files need them
+_worker_chunker = None
+
+def _init_worker(engine, max_file_size=MAX_FILE_SIZE, parse_timeout=None, languages=None):
+    global _worker_chunker
+    _worker_chunker = Chunker(engine=engine, max_file_size=max_file_size, parse_timeout=parse_timeout, verbose=False,
+                              languages=languages)
+
+def _drain_skipped():
+    skipped = _worker_chunker.skipped
+    _worker_chunker.skipped = []
+    return skipped
+
+def _extract_in_worker(file_path):
+    # what the worker skipped goes back with the result, so the parent can report it
+    return _worker_chunker.extract_callees_and_body(file_path), _drain_skipped()
+
+def _extract_content_in_worker(item):
+    file_path, content = item
+    return _worker_chunker.extract_from_content(file_path, content), _drain_skipped()
 
 class Chunker:
-    def __init__(self):
-        self.__parsers = {
-        '.py': get_parser('python'),
-        '.js': get_parser('javascript'),
-        '.java': get_parser('java'),
-        '.cpp': get_parser('cpp'),
-        '.cc': get_parser('cpp'),
-        '.c': get_parser('c'),
-        '.h': get_parser('c'),
-        '.cs': get_parser('c_sharp'),
-    }
+    # engine is "query" for the compiled tree-sitter queries in extract.py, 
+    # or "walk" for the original AST walk below.
+    # Discovery skips VCS_DIRS and every directory named in exclude_dirs (e.g. VENDOR_DIRS + TEST_DIRS),
+    # and only follows directory symlinks with follow_symlinks. Files over max_file_size bytes 
+    # (None for no limit) aren't parsed, nor are files tree-sitter can't parse within parse_timeout 
+    # seconds. Whatever was left out is in skipped, as (path, reason) pairs.
+    # compact makes the read_and_parse_* methods return a FunctionTable instead of a list of tuples,
+    # which CallGraph.from_records uses as is.
+    # languages (e.g. parsers.C_FAMILY) limits the files parsed to those languages' extensions, 
+    # parsers come from parsers.registry, so a Chunker costs nothing to make and loads no grammar
+    # until a file of its language shows up
+    def __init__(self, workers : int = 1, cache : ParseCache = None, engine : str = "query", store : FunctionStore = None,
+                 exclude_dirs=(), max_file_size : int = MAX_FILE_SIZE, parse_timeout : float = None,
+                 follow_symlinks : bool = False, verbose : bool = True, compact : bool = False, languages=None):
+        if engine not in ("query", "walk"):
+            raise ValueError(f"unknown engine: {engine}")
+        self.workers = workers
+        self.cache = cache
+        self.store = store
+        self.engine = engine
+        self.exclude_dirs = set(VCS_DIRS) | set(exclude_dirs)
+        self.max_file_size = max_file_size
+        self.parse_timeout = parse_timeout
+        self.follow_symlinks = follow_symlinks
+        self.verbose = verbose
+        self.compact = compact
+        self.languages = tuple(languages) if languages is not None else None
+        self.skipped = []
+        self.__extensions = extensions(languages)
+        self.__timeout_micros = int(parse_timeout * 1000000) if parse_timeout is not None else 0
         
+    def __skip(self, path, reason):
+        self.skipped.append((path, reason))
+        metrics.count(f"skipped_{reason}")
+        if self.verbose:
+            print("Skipping", path, f"({reason})")
+    
+    def __too_large(self, path, size):
+        if self.max_file_size is not None and size > self.max_file_size:
+            self.__skip(path, "too_large")
+            return True
+        return False
         
     def __get_all_files(self, repo_path):
-        file_paths = []
-        for root, dirs, files in os.walk(repo_path):
-            for file in files:
-                file_paths.append(os.path.join(root, file))
-        return file_paths
+        # the code files under repo_path, lazily and in os.walk's order
+        seen = set()
+        stack = [repo_path]
+        while stack:
+            directory = stack.pop()
+            with metrics.stage("discover"):
+                if self.follow_symlinks:
+                    # every directory once: a link back up the tree would otherwise be walked 
+                    # forever, and one to a sibling would give its files twice
+                    try:
+                        stat = os.stat(directory)
+                    except OSError:
+                        self.__skip(directory, "unreadable")
+                        continue
+                    if (stat.st_dev, stat.st_ino) in seen:
+                        self.__skip(directory, "already_walked")
+                        continue
+                    seen.add((stat.st_dev, stat.st_ino))
+                
+                try:
+                    with os.scandir(directory) as it:
+                        entries = list(it)
+                except OSError:
+                    self.__skip(directory, "unreadable")
+                    continue
+                
+                subdirectories = []
+                file_paths = []
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=self.follow_symlinks):
+                            if entry.name not in self.exclude_dirs:
+                                subdirectories.append(entry.path)
+                            continue
+                        # the extension first, most files aren't code and need no stat
+                        if not self.__is_code_file(entry.name) or not entry.is_file():
+                            continue
+                        size = entry.stat().st_size
+                    except OSError:
+                        self.__skip(entry.path, "unreadable")
+                        continue
+                    if not self.__too_large(entry.path, size):
+                        file_paths.append(entry.path)
+                stack.extend(reversed(subdirectories))
+            yield from file_paths
     
     def __is_code_file(self, file_path):
-        return os.path.splitext(file_path)[1] in self.__parsers
+        return os.path.splitext(file_path)[1] in self.__extensions
+    
+    def __parser(self, ext):
+        return registry.parser(self.__extensions[ext], self.__timeout_micros)
     
     def __extract_chunks(self, file_path):
         
         ext = os.path.splitext(file_path)[1]
-        parser = self.__parsers[ext]
+        parser = self.__parser(ext)
         
         with open(file_path, 'rb') as f:
             content = f.read()
@@ -58,11 +168,71 @@ class Chunker:
         return chunks
     
     def extract_callees_and_body(self, file_path):
-        ext = os.path.splitext(file_path)[1]
-        parser = self.__parsers[ext]
-        
         with open(file_path, 'rb') as f:
             content = f.read()
+        return self.extract_from_content(file_path, content)
+    
+    def extract_from_content(self, file_path, content):
+        # file_path only picks the parser and is reported, the file itself is never read
+        if metrics.enabled:
+            metrics.count("files")
+            metrics.count("bytes", len(content))
+        
+        if self.cache is None:
+            return self.__timed_parse(file_path, content) or []
+        
+        key = self.cache.key(os.path.splitext(file_path)[1], content)
+        cached = self.cache.get(key)
+        if cached is None:
+            chunks = self.__timed_parse(file_path, content)
+            if chunks is None:
+                return []
+            self.__cache_chunks(key, chunks)
+            return chunks
+        metrics.count("cache_hits")
+        return self.__with_path(file_path, cached)
+    
+    def __timed_parse(self, file_path, content):
+        if not metrics.enabled:
+            return self.__parse_callees_and_body(file_path, content)
+        start = time.perf_counter()
+        chunks = self.__parse_callees_and_body(file_path, content)
+        seconds = time.perf_counter() - start
+        metrics.add_time("parse", seconds)
+        metrics.observe_file(file_path, seconds, len(content))
+        metrics.count("files_parsed")
+        return chunks
+    
+    def __cache_chunks(self, key, chunks):
+        # the path is left out, the same content may show up under another name
+        self.cache.put(key, [(function_signature, callees, function_body) for _, function_signature, callees, function_body in chunks])
+    
+    def __with_path(self, file_path, cached):
+        return [(file_path, function_signature, list(callees), function_body) for function_signature, callees, function_body in cached]
+    
+    def __parse_callees_and_body(self, file_path, content):
+        # None for a file that was skipped, which isn't cached: another run may have more time
+        ext = os.path.splitext(file_path)[1]
+        try:
+            if self.engine == "query":
+                return self.__extractor(ext).extract(file_path, content)
+            return self.walk_callees_and_body(file_path, content)
+        except ValueError:
+            # what tree-sitter raises when parse_timeout runs out
+            if self.parse_timeout is None:
+                raise
+            self.__parser(ext).reset()
+            self.__skip(file_path, "timeout")
+        except RecursionError:
+            self.__skip(file_path, "too_deep")
+        return None
+    
+    def __extractor(self, ext):
+        return registry.extractor(self.__extensions[ext], self.__timeout_micros)
+    
+    def walk_callees_and_body(self, file_path, content):
+        ext = os.path.splitext(file_path)[1]
+        parser = self.__parser(ext)
             
         tree = parser.parse(content)
 
@@ -90,9 +260,7 @@ class Chunker:
         
     
     def read_and_parse_documents(self, repo_path):
-        code_files = [
-            f for f in self.__get_all_files(repo_path) if self.__is_code_file(f)
-        ]
+        code_files = list(self.__get_all_files(repo_path))
         documents = []
         
         for file_path in code_files:
@@ -105,18 +273,210 @@ class Chunker:
         
         return documents
     
-    def read_and_parse_documents_with_callees(self, repo_path):
+    def __map_files(self, code_files, workers):
+        if workers <= 1 or len(code_files) < 2:
+            return map(self.extract_callees_and_body, code_files)
+        
+        if self.cache is None:
+            return [chunks for chunks, _ in self.__map_in_pool(_extract_in_worker, code_files, workers)]
+        
+        # serve cache hits here and only send the changed files to the pool
+        results = [None] * len(code_files)
+        missing = []
+        for idx, file_path in enumerate(code_files):
+            with open(file_path, 'rb') as f:
+                key = self.cache.key(os.path.splitext(file_path)[1], f.read())
+            cached = self.cache.get(key)
+            if cached is None:
+                missing.append((idx, key))
+            else:
+                results[idx] = self.__with_path(file_path, cached)
+        
+        parsed = self.__map_in_pool(_extract_in_worker, [code_files[idx] for idx, _ in missing], workers)
+        for (idx, key), (chunks, skipped) in zip(missing, parsed):
+            if not skipped:
+                self.__cache_chunks(key, chunks)
+            results[idx] = chunks
+        return results
+    
+    def __map_in_pool(self, function, items, workers):
+        # (chunks, skipped) for every item, what the workers skipped is reported here too
+        if not items:
+            return []
+        # executor.map keeps the input order, so the output matches the serial path
+        chunksize = max(1, len(items) // (workers * 8))
+        initargs = (self.engine, self.max_file_size, self.parse_timeout, self.languages)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+            results = list(executor.map(function, items, chunksize=chunksize))
+        for _, skipped in results:
+            for path, reason in skipped:
+                self.__skip(path, reason)
+        return results
+    
+    def read_and_parse_documents_with_callees(self, repo_path, workers : int = None):
+        return self.read_and_parse_files(self.__get_all_files(repo_path), workers)
+    
+    def __store_project(self, project):
+        # parses that leave files out by design (some languages, excluded directories) or
+        # take more in (followed symlinks) are stored apart from full ones
+        scope = []
+        if self.languages is not None:
+            scope.append('+'.join(sorted(self.languages)))
+        excluded = sorted(self.exclude_dirs - set(VCS_DIRS))
+        if excluded:
+            scope.append("-" + '-'.join(excluded))
+        if self.follow_symlinks:
+            scope.append("symlinks")
+        return ':'.join([project, *scope])
+    
+    def stored(self, project, commit_id) -> bool:
+        # whether read_and_parse_commit would give the store's copy
+        return self.store is not None and self.store.has(self.__store_project(project), commit_id)
+    
+    def read_and_parse_commit(self, repo_path, project, commit_id, workers : int = None, display_path : str = None, from_git : bool = False):
+        # the store's copy if this commit of the project was parsed before, 
+        # otherwise parses repo_path (which must be checked out at commit_id) and stores it.
+        # With from_git the files are read from repo_path's object database instead, repo_path
+        # can then be a bare mirror at any commit. display_path, if given, replaces repo_path 
+        # at the start of the reported file paths
+        if self.store is not None:
+            with metrics.stage("store_load"):
+                documents = self.store.load(self.__store_project(project), commit_id)
+            if documents is not None:
+                metrics.count("store_hits")
+                return FunctionTable(documents) if self.compact else documents
+        
+        skipped = len(self.skipped)
+        if from_git:
+            documents = self.read_and_parse_tree(repo_path, commit_id, workers, display_path)
+        else:
+            documents = self.read_and_parse_documents_with_callees(repo_path, workers)
+        if not from_git and display_path is not None and display_path != repo_path and self.compact:
+            documents.replace_path_prefix(repo_path, display_path)
+        elif not from_git and display_path is not None and display_path != repo_path:
+            documents = [
+                (display_path + file_path[len(repo_path):], function_signature, callees, function_body)
+                for file_path, function_signature, callees, function_body in documents
+            ]
+        if self.store is not None and len(self.skipped) > skipped:
+            # too large, timed out, unreadable: like ParseCache, what may come out whole
+            # on another run isn't kept, the store would serve it as the complete commit
+            metrics.count("store_incomplete")
+        elif self.store is not None:
+            with metrics.stage("store_save"):
+                self.store.save(self.__store_project(project), commit_id, documents)
+        return documents
+    
+    def read_and_parse_tree(self, repo_path, revision, workers : int = None, display_path : str = None):
+        # read_and_parse_documents_with_callees for the tree at revision, read out of git.
+        # Files come in git's (sorted) order, and with a cache the files a previous 
+        # revision already had are served by blob id without being read at all
+        if workers is None:
+            workers = self.workers
+        root = display_path if display_path is not None else repo_path
+        documents = FunctionTable() if self.compact else []
+        with GitTree(repo_path, revision) as tree:
+            with metrics.stage("discover"):
+                entries = [
+                    (os.path.join(root, path), blob) for path, blob, size in tree.entries()
+                    if self.__is_code_file(path) and not self.__too_large(os.path.join(root, path), size)
+                ]
+            for chunks in self.__map_blobs(tree, entries, workers):
+                documents.extend(chunks)
+        metrics.count("functions", len(documents))
+        return documents
+    
+    def __map_blobs(self, tree, entries, workers):
+        results = [None] * len(entries)
+        missing = []
+        for idx, (file_path, blob) in enumerate(entries):
+            if self.cache is not None:
+                key = self.cache.blob_key(os.path.splitext(file_path)[1], blob)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    metrics.count("cache_hits")
+                    results[idx] = self.__with_path(file_path, cached)
+                    continue
+            missing.append(idx)
+        
+        # read as they are parsed, one blob in memory at a time when there's no pool
+        contents = ((entries[idx][0], tree.read(entries[idx][1])) for idx in missing)
+        if workers <= 1 or len(missing) < 2:
+            parsed = ((chunks or [], chunks is None) for chunks in map(self.__extract_uncached, contents))
+        else:
+            parsed = self.__map_in_pool(_extract_content_in_worker, list(contents), workers)
+        
+        for idx, (chunks, skipped) in zip(missing, parsed):
+            if self.cache is not None and not skipped:
+                file_path, blob = entries[idx]
+                self.__cache_chunks(self.cache.blob_key(os.path.splitext(file_path)[1], blob), chunks)
+            results[idx] = chunks
+        return results
+    
+    def __extract_uncached(self, item):
+        file_path, content = item
+        if metrics.enabled:
+            metrics.count("files")
+            metrics.count("bytes", len(content))
+        return self.__timed_parse(file_path, content)
+    
+    def iter_records(self, repo_path):
+        # Lazy version of read_and_parse_documents_with_callees: yields a FunctionRecord per
+        # function, in the same order, one file at a time. Bodies stay on disk until asked for,
+        # so the checkout must not change while the records are in use.
+        for file_path in self.__get_all_files(repo_path):
+            with open(file_path, 'rb') as f:
+                content = f.read()
+            try:
+                offsets = self.__extractor(os.path.splitext(file_path)[1]).extract_offsets(content)
+            except ValueError:
+                if self.parse_timeout is None:
+                    raise
+                self.__parser(os.path.splitext(file_path)[1]).reset()
+                self.__skip(file_path, "timeout")
+                continue
+            if not offsets:
+                continue
+            source = SourceFile(file_path)
+            for function_signature, callees, start_byte, end_byte in offsets:
+                yield FunctionRecord(source, function_signature, callees, start_byte, end_byte)
+    
+    def identifier_index(self, repo_path) -> IdentifierIndex:
+        # the code files discovery finds, indexed by the identifiers they contain
+        with metrics.stage("index"):
+            return IdentifierIndex(self.__get_all_files(repo_path))
+    
+    def read_and_parse_documents_referencing(self, repo_path, names, exclude=(), workers : int = None):
+        # only parse the files whose text mentions one of the names, 
+        # the others can neither call nor define them
+        names = [name for name in names if name]
+        if not names:
+            return []
+        pattern = re.compile(
+            rb"(?<![A-Za-z0-9_])(?:" + b"|".join(re.escape(name.encode('utf-8')) for name in sorted(set(names), key=len, reverse=True)) + rb")(?![A-Za-z0-9_])"
+        )
+        exclude = {os.path.normpath(f) for f in exclude}
+        
+        code_files = []
+        for file_path in self.__get_all_files(repo_path):
+            if os.path.normpath(file_path) in exclude:
+                continue
+            with open(file_path, 'rb') as f:
+                if pattern.search(f.read()):
+                    code_files.append(file_path)
+        return self.read_and_parse_files(code_files, workers)
+    
+    def read_and_parse_files(self, file_paths, workers : int = None):
+        if workers is None:
+            workers = self.workers
         code_files = [
-            f for f in self.__get_all_files(repo_path) if self.__is_code_file(f)
+            f for f in file_paths if self.__is_code_file(f) and os.path.isfile(f) and not self.__too_large(f, os.path.getsize(f))
         ]
-        documents = []
+        documents = FunctionTable() if self.compact else []
         
-        for file_path in code_files:
-                chunks = self.extract_callees_and_body(file_path)
-                
-                for chunk in chunks:
-                    file_path, function_signature, callees, function_body = chunk   
-                    documents.append((file_path, function_signature, callees, function_body))
+        for chunks in self.__map_files(code_files, workers):
+            documents.extend(chunks)
+        metrics.count("functions", len(documents))
         
         return documents
         
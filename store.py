@@ -0,0 +1,111 @@
+import json
+import sqlite3
+from callgraph import get_function_name
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS parses (
+    id INTEGER PRIMARY KEY,
+    project TEXT NOT NULL,
+    commit_id TEXT NOT NULL,
+    UNIQUE (project, commit_id)
+);
+CREATE TABLE IF NOT EXISTS functions (
+    id INTEGER PRIMARY KEY,
+    parse_id INTEGER NOT NULL REFERENCES parses(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    file_path TEXT NOT NULL,
+    function_signature TEXT NOT NULL,
+    function_name TEXT NOT NULL,
+    callees TEXT NOT NULL,
+    function_body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS calls (
+    function_id INTEGER NOT NULL REFERENCES functions(id) ON DELETE CASCADE,
+    callee TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS functions_by_parse ON functions (parse_id, seq);
+CREATE INDEX IF NOT EXISTS functions_by_name ON functions (parse_id, function_name);
+CREATE INDEX IF NOT EXISTS calls_by_callee ON calls (callee, function_id);
+CREATE INDEX IF NOT EXISTS calls_by_function ON calls (function_id);
+"""
+
+
+# Parsed functions of a project at a commit, kept in a local SQLite file so reruns
+# over commits that were already seen skip the clone and the parse.
+#
+# A commit is either stored with all its functions or not at all (one transaction
+# per save), and load gives back the same tuples, in the same order, as the parse.
+class FunctionStore:
+    def __init__(self, path : str = "functions.sqlite", timeout : float = 60.0):
+        self.path = path
+        # several pipeline processes may write at once, wait for the lock rather than fail
+        self.connection = sqlite3.connect(path, timeout=timeout)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __parse_id(self, project, commit_id):
+        row = self.connection.execute(
+            "SELECT id FROM parses WHERE project = ? AND commit_id = ?", (project, commit_id)
+        ).fetchone()
+        return row[0] if row else None
+
+    def has(self, project : str, commit_id : str) -> bool:
+        return self.__parse_id(project, commit_id) is not None
+
+    def save(self, project : str, commit_id : str, data) -> None:
+        with self.connection:
+            self.connection.execute("DELETE FROM parses WHERE project = ? AND commit_id = ?", (project, commit_id))
+            parse_id = self.connection.execute(
+                "INSERT INTO parses (project, commit_id) VALUES (?, ?)", (project, commit_id)
+            ).lastrowid
+
+            for seq, entry in enumerate(data):
+                file_path, function_signature, callees, function_body = entry
+                function_id = self.connection.execute(
+                    "INSERT INTO functions (parse_id, seq, file_path, function_signature, function_name, callees, function_body) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (parse_id, seq, file_path, function_signature, get_function_name(function_signature), json.dumps(callees), function_body)
+                ).lastrowid
+                self.connection.executemany(
+                    "INSERT INTO calls (function_id, callee) VALUES (?, ?)",
+                    ((function_id, callee) for callee in dict.fromkeys(callees))
+                )
+
+    def remove(self, project : str, commit_id : str) -> None:
+        with self.connection:
+            self.connection.execute("DELETE FROM parses WHERE project = ? AND commit_id = ?", (project, commit_id))
+
+    @staticmethod
+    def __entry(row):
+        file_path, function_signature, callees, function_body = row
+        return (file_path, function_signature, json.loads(callees), function_body)
+
+    def load(self, project : str, commit_id : str) -> list:
+        # None if the commit was never stored
+        parse_id = self.__parse_id(project, commit_id)
+        if parse_id is None:
+            return None
+        rows = self.connection.execute(
+            "SELECT file_path, function_signature, callees, function_body FROM functions WHERE parse_id = ? ORDER BY seq", (parse_id,)
+        )
+        return [self.__entry(row) for row in rows]
+
+    def functions_named(self, project : str, commit_id : str, function_name : str) -> list:
+        rows = self.connection.execute(
+            "SELECT f.file_path, f.function_signature, f.callees, f.function_body FROM functions f "
+            "JOIN parses p ON p.id = f.parse_id WHERE p.project = ? AND p.commit_id = ? AND f.function_name = ? ORDER BY f.seq",
+            (project, commit_id, function_name)
+        )
+        return [self.__entry(row) for row in rows]
+
+    def callers_of(self, project : str, commit_id : str, callee : str) -> list:
+        rows = self.connection.execute(
+            "SELECT f.file_path, f.function_signature, f.callees, f.function_body FROM calls c "
+            "JOIN functions f ON f.id = c.function_id JOIN parses p ON p.id = f.parse_id "
+            "WHERE p.project = ? AND p.commit_id = ? AND c.callee = ? ORDER BY f.seq",
+            (project, commit_id, callee)
+        )
+        return [self.__entry(row) for row in rows]
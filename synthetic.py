@@ -0,0 +1,81 @@
+import os
+import random
+
+# Deterministic synthetic C/C++ repositories, for benchmarks that can't depend on the network.
+#
+# The same arguments always give the same files, byte for byte. Functions are named
+# fn_<file>_<index> and call fan_out functions picked from the whole repo. Every
+# near_duplicates-th function gets a copy in another file, renamed and with one constant
+# changed, close enough that the matcher still scores it above 0.9 like a fix commit would.
+
+STATEMENTS = [
+    "    int {v} = {a} * {k} + {b};\n",
+    "    {a} = ({a} << {s}) ^ {b};\n",
+    "    if ({a} > {k}) {{\n        {b} -= {a} / {s};\n    }}\n",
+    "    for (int i = 0; i < {k}; i++) {{\n        {a} += buffer[i % {s}] * {b};\n    }}\n",
+    "    while ({a} > {k}) {{\n        {a} >>= {s};\n    }}\n",
+    "    buffer[{s}] = (char)({a} & 0xff);\n",
+    "    {b} = {a} % {k} ? {b} + {s} : {b} - {s};\n",
+]
+
+
+def _statement(rng, idx):
+    return rng.choice(STATEMENTS).format(
+        v=f"tmp{idx}", a=rng.choice(["left", "right"]), b=rng.choice(["left", "right"]),
+        k=rng.randint(2, 4096), s=rng.randint(1, 7),
+    )
+
+
+def _function(name, callees, statements):
+    calls = "".join(f"    right += {callee}(left, right);\n" for callee in callees)
+    return (
+        f"int {name}(int left, int right)\n"
+        "{\n"
+        "    char buffer[16] = {0};\n"
+        f"{''.join(statements)}"
+        f"{calls}"
+        "    return left + right;\n"
+        "}\n"
+    )
+
+
+def generate_repo(path : str, files : int = 50, functions_per_file : int = 20, fan_out : int = 3,
+                  near_duplicates : int = 10, statements : int = 8, seed : int = 0) -> dict:
+    # writes the repo under path and returns {"functions": [...], "duplicates": [(original, copy), ...]}
+    # where the duplicates are (name, body) pairs, handy as targets for the matcher
+    rng = random.Random(seed)
+    names = [[f"fn_{file_idx}_{fn_idx}" for fn_idx in range(functions_per_file)] for file_idx in range(files)]
+    flat_names = [name for file_names in names for name in file_names]
+
+    bodies = dict()
+    sources = []
+    for file_idx in range(files):
+        parts = ["#include <stdio.h>\n", "#include <string.h>\n", "\n"]
+        for name in names[file_idx]:
+            callees = rng.sample(flat_names, min(fan_out, len(flat_names)))
+            # lengths vary like real code does, from a couple of lines to a few times the average
+            count = rng.randint(1, statements * 2)
+            body = _function(name, callees, [_statement(rng, idx) for idx in range(count)])
+            bodies[name] = body
+            parts.append(body)
+            parts.append("\n")
+        sources.append(parts)
+
+    duplicates = []
+    if near_duplicates:
+        for idx, name in enumerate(flat_names[::near_duplicates]):
+            copy_name = f"{name}_copy"
+            # one constant changed, as small as most security fixes
+            body = bodies[name].replace(name, copy_name, 1).replace("char buffer[16]", "char buffer[32]", 1)
+            sources[(idx * 7 + 1) % files].extend([body, "\n"])
+            duplicates.append(((name, bodies[name]), (copy_name, body)))
+
+    for file_idx, parts in enumerate(sources):
+        # a C++ file every fourth, and files spread over a few directories
+        ext = ".cpp" if file_idx % 4 == 3 else ".c"
+        directory = os.path.join(path, f"module_{file_idx % 8}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"file_{file_idx}{ext}"), 'w') as file:
+            file.write("".join(parts))
+
+    return {"functions": flat_names, "duplicates": duplicates}
@@ -0,0 +1,133 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# A small C project in a local bare repo, and a PrimeVul-shaped dataset pointing at it.
+#
+#   base  src/parser.c (parse_header, helpers), src/check.c (check_len), docs/README.txt
+#   fix   adds a bounds check to parse_header
+#   fix2  adds one to check_len
+#
+# Authors and dates are fixed, so the commit ids are the same on every machine.
+
+GIT_ENV = {
+    "GIT_AUTHOR_NAME": "fixture",
+    "GIT_AUTHOR_EMAIL": "fixture@example.com",
+    "GIT_AUTHOR_DATE": "2024-01-01T00:00:00Z",
+    "GIT_COMMITTER_NAME": "fixture",
+    "GIT_COMMITTER_EMAIL": "fixture@example.com",
+    "GIT_COMMITTER_DATE": "2024-01-01T00:00:00Z",
+    "GIT_CONFIG_NOSYSTEM": "1",
+}
+
+
+def git(*args, cwd=None) -> str:
+    env = dict(os.environ, **GIT_ENV)
+    env["HOME"] = cwd or os.getcwd()
+    result = subprocess.run(["git", *args], cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+
+def function(name, signature, calls, check=None) -> str:
+    lines = [f"int {name}({signature}) {{", "    int total = 0;"]
+    if check is not None:
+        lines.append(f"    if ({check}) return -1;")
+    lines += [f"    total += {callee}(buf, len + {idx});" for idx, callee in enumerate(calls)]
+    lines += ["    return total;", "}"]
+    return "\n".join(lines)
+
+
+HELPERS = "\n\n".join(f"int helper_{idx}(char *buf, int len) {{\n    return buf[len % 16] + {idx};\n}}" for idx in range(3))
+CALLS = [f"helper_{idx % 3}" for idx in range(24)]
+
+
+def parse_header(fixed=False) -> str:
+    return function("parse_header", "char *buf, int len", CALLS, "len < 0" if fixed else None)
+
+
+def check_len(fixed=False) -> str:
+    # short and varied, unlike parse_header, so neither is taken for the other
+    lines = [
+        "int check_len(char *buf, int len, int flags) {",
+        "    int acc = 0;",
+        *(["    if (len > 4096) return -1;"] if fixed else []),
+        "    if (flags & 1) acc += helper_0(buf, len);",
+        "    while (len-- > 0) {",
+        "        acc = acc * 31 + buf[len];",
+        "    }",
+        "    switch (flags) {",
+        "    case 2: acc ^= helper_1(buf, acc); break;",
+        "    default: acc -= helper_2(buf, 7);",
+        "    }",
+        "    return parse_header(buf, acc) + acc;",
+        "}",
+    ]
+    return "\n".join(lines)
+
+
+def write_tree(path, name, fix=False, fix2=False):
+    os.makedirs(os.path.join(path, "src"), exist_ok=True)
+    os.makedirs(os.path.join(path, "docs"), exist_ok=True)
+    with open(os.path.join(path, "src", "parser.c"), "w") as file:
+        file.write(HELPERS + "\n\n" + parse_header(fix) + "\n")
+    with open(os.path.join(path, "src", "check.c"), "w") as file:
+        file.write(check_len(fix2) + "\n")
+    with open(os.path.join(path, "docs", "README.txt"), "w") as file:
+        # the name keeps every remote's commit ids apart
+        file.write(f"{name}, not code\n")
+
+
+def make_remote(root, name="remote") -> dict:
+    # a bare repo at root/name.git; returns its url and the ids of its three commits
+    work = os.path.join(root, f"{name}-work")
+    os.makedirs(work)
+    git("init", "--quiet", "--initial-branch=main", cwd=work)
+    commits = dict()
+    for label, state in (("base", {}), ("fix", {"fix": True}), ("fix2", {"fix": True, "fix2": True})):
+        write_tree(work, name, **state)
+        git("add", "-A", cwd=work)
+        git("commit", "--quiet", "-m", label, cwd=work)
+        commits[label] = git("rev-parse", "HEAD", cwd=work)
+    bare = os.path.join(root, f"{name}.git")
+    git("clone", "--quiet", "--bare", work, bare, cwd=root)
+    # lets the blobless fetch filter, like a hosted remote does
+    git("config", "uploadpack.allowFilter", "true", cwd=bare)
+    return {"url": f"file://{bare}", "path": bare, "work": work, **commits}
+
+
+@pytest.fixture
+def remote(tmp_path):
+    return make_remote(str(tmp_path))
+
+
+@pytest.fixture
+def dataset(tmp_path, remote, monkeypatch):
+    # pairwise.main's working directory: functional/primevul_*.jsonl and mapping.json
+    # the journal takes records with the same project, commit and function for one entry,
+    # so each split has its own, like PrimeVul
+    splits = {
+        "train": [
+            {"project": "proj", "commit_id": remote["fix"], "func": parse_header(), "target": 1},
+            {"project": "other", "commit_id": "0" * 40, "func": "int f(void) {}", "target": 1},
+        ],
+        "test": [
+            {"project": "proj", "commit_id": remote["fix2"], "func": check_len(), "target": 1},
+        ],
+        "valid": [
+            {"project": "proj", "commit_id": remote["fix2"], "func": check_len(True), "target": 0},
+        ],
+    }
+    run = tmp_path / "run"
+    (run / "functional").mkdir(parents=True)
+    for split, records in splits.items():
+        with open(run / "functional" / f"primevul_{split}.jsonl", "w") as file:
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+    with open(run / "mapping.json", "w") as file:
+        json.dump({"proj": remote["url"]}, file)
+    monkeypatch.chdir(run)
+    return run
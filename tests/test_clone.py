@@ -0,0 +1,94 @@
+import os
+from clone import Cloner, RepositoryCache
+from conftest import git, make_remote, parse_header
+
+
+def read(path):
+    with open(path) as file:
+        return file.read()
+
+
+def test_mirror_is_reused(tmp_path, remote):
+    cache = RepositoryCache(str(tmp_path / "mirrors"), str(tmp_path / "projects"))
+    cloner = cache.checkout("proj", remote["url"], remote["fix"])
+    assert cloner is not None
+
+    # the mirror has the commit, so a dead url doesn't matter
+    cloner = cache.checkout("proj", "file:///nonexistent.git", remote["fix2"])
+    assert cloner is not None
+    assert cloner.checkout_to_vulnerable(remote["fix"])
+    assert parse_header() in read(tmp_path / "projects" / "proj" / "src" / "parser.c")
+
+
+def test_mirror_fetches_missing_commit(tmp_path, remote):
+    cache = RepositoryCache(str(tmp_path / "mirrors"), str(tmp_path / "projects"))
+    assert cache.ensure_mirror("proj", remote["url"], remote["fix"])
+
+    with open(os.path.join(remote["work"], "new.c"), "w") as file:
+        file.write("int added(void) { return 0; }\n")
+    git("add", "-A", cwd=remote["work"])
+    git("commit", "--quiet", "-m", "later", cwd=remote["work"])
+    git("push", "--quiet", remote["path"], "main", cwd=remote["work"])
+    later = git("rev-parse", "HEAD", cwd=remote["work"])
+
+    assert not cache.has_commit("proj", later)
+    assert cache.ensure_mirror("proj", remote["url"], later)
+
+
+def test_worktrees_are_leased_and_reused(tmp_path, remote):
+    cache = RepositoryCache(str(tmp_path / "mirrors"), str(tmp_path / "projects"))
+    assert cache.ensure_mirror("proj", remote["url"])
+    first = cache.lease_worktree("proj", remote["base"])
+    second = cache.lease_worktree("proj", remote["fix"])
+    assert first != second
+
+    cache.release_worktree("proj", first)
+    assert cache.lease_worktree("proj", remote["fix"]) == first
+    assert "len < 0" in read(os.path.join(first, "src", "parser.c"))
+
+    cache.release_worktree("proj", first)
+    cache.release_worktree("proj", second)
+    cache.remove_released_worktrees()
+    assert not os.path.exists(first) and not os.path.exists(second)
+
+
+def test_fetch_commit(tmp_path, remote):
+    cloner = Cloner(str(tmp_path / "projects"))
+    assert cloner.fetch_commit(remote["url"], remote["fix"])
+    assert cloner.changed_files(remote["fix"]) == ["src/parser.c"]
+
+    assert cloner.checkout_to_vulnerable(remote["fix"])
+    assert "len < 0" not in read(tmp_path / "projects" / "repo" / "src" / "parser.c")
+    assert cloner.checkout_to_benign(remote["fix"])
+    assert "len < 0" in read(tmp_path / "projects" / "repo" / "src" / "parser.c")
+    # only the commit and its parent
+    assert git("rev-list", "--count", "HEAD", cwd=str(tmp_path / "projects" / "repo")) == "2"
+
+
+def test_fetch_commit_blobless(tmp_path, remote):
+    cloner = Cloner(str(tmp_path / "projects"), blobless=True)
+    assert cloner.fetch_commit(remote["url"], remote["fix2"])
+    repo = str(tmp_path / "projects" / "repo")
+    assert git("config", "remote.origin.partialclonefilter", cwd=repo) == "blob:none"
+    # the checkout fetches the blobs it needs
+    assert cloner.checkout_to_vulnerable(remote["fix2"])
+    assert "len > 4096" not in read(os.path.join(repo, "src", "check.c"))
+
+
+def test_fetch_commit_sparse(tmp_path, remote):
+    cloner = Cloner(str(tmp_path / "projects"), sparse=True)
+    assert cloner.fetch_commit(remote["url"], remote["fix"])
+    assert cloner.checkout_to_benign(remote["fix"])
+    repo = tmp_path / "projects" / "repo"
+    assert (repo / "src" / "parser.c").exists()
+    assert not (repo / "docs" / "README.txt").exists()
+
+
+def test_fetch_commit_switches_project(tmp_path, remote):
+    other = make_remote(str(tmp_path), "other")
+    cloner = Cloner(str(tmp_path / "projects"))
+    assert cloner.fetch_commit(remote["url"], remote["fix"])
+    assert cloner.fetch_commit(other["url"], other["fix2"])
+    repo = str(tmp_path / "projects" / "repo")
+    assert git("remote", "get-url", "origin", cwd=repo) == other["url"]
+    assert cloner.checkout_to_benign(other["fix2"])
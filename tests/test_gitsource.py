@@ -0,0 +1,66 @@
+import os
+import pytest
+from conftest import git
+from gitsource import GitTree
+from split import Chunker
+
+
+def checkout_files(work):
+    files = dict()
+    for root, dirs, names in os.walk(work):
+        dirs[:] = [d for d in dirs if d != ".git"]
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                continue
+            with open(path, 'rb') as file:
+                files[os.path.relpath(path, work)] = file.read()
+    return files
+
+
+def tree_files(repo_path, revision):
+    with GitTree(repo_path, revision) as tree:
+        return {path: tree.read(blob) for path, blob, size in tree.entries()}
+
+
+@pytest.mark.parametrize("label", ["base", "fix", "fix2"])
+def test_reads_match_worktree(remote, label):
+    git("checkout", "--quiet", remote[label], cwd=remote["work"])
+    # from the bare mirror, no checkout involved
+    assert tree_files(remote["path"], remote[label]) == checkout_files(remote["work"])
+
+
+def test_parent_revision_and_sizes(remote):
+    git("checkout", "--quiet", remote["fix"], cwd=remote["work"])
+    with GitTree(remote["path"], f"{remote['fix2']}^") as tree:
+        for path, blob, size in tree.entries():
+            content = tree.read(blob)
+            assert len(content) == size
+            with open(os.path.join(remote["work"], path), 'rb') as file:
+                assert content == file.read()
+
+
+def test_symlinks_are_left_out(remote):
+    os.symlink("src/parser.c", os.path.join(remote["work"], "link.c"))
+    git("add", "-A", cwd=remote["work"])
+    git("commit", "--quiet", "-m", "link", cwd=remote["work"])
+    with GitTree(remote["work"], "HEAD") as tree:
+        assert "link.c" not in {path for path, _, _ in tree.entries()}
+
+
+def test_unknown_revision_and_blob(remote):
+    with GitTree(remote["path"], "0" * 40) as tree:
+        with pytest.raises(ValueError):
+            tree.entries()
+        with pytest.raises(ValueError):
+            tree.read("0" * 40)
+
+
+def test_parse_tree_matches_checkout(remote):
+    git("checkout", "--quiet", remote["fix2"], cwd=remote["work"])
+    chunker = Chunker(verbose=False)
+    from_checkout = chunker.read_and_parse_documents_with_callees(remote["work"])
+    # reported as if parsed in the worktree, in git's path order
+    from_git = chunker.read_and_parse_tree(remote["path"], remote["fix2"], display_path=remote["work"])
+    assert sorted(from_git) == sorted(from_checkout)
+    assert [entry[0] for entry in from_git] == sorted(entry[0] for entry in from_git)
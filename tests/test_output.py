@@ -0,0 +1,61 @@
+import orjson
+from output import ShardedWriter
+
+
+def read(path):
+    with open(path, 'rb') as file:
+        return [orjson.loads(line) for line in file]
+
+
+def test_order_without_shards(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    with ShardedWriter(path, mode="a", batch_size=3) as writer:
+        for idx in range(10):
+            # the shard is ignored when the path has no {shard}
+            writer.write({"idx": idx}, shard=f"project{idx % 3}")
+    assert read(path) == [{"idx": idx} for idx in range(10)]
+
+
+def test_shards_keep_their_order(tmp_path):
+    path = str(tmp_path / "by_cwe" / "{shard}.jsonl")
+    records = [{"idx": idx, "cwe": f"CWE-{idx % 3}"} for idx in range(20)]
+    with ShardedWriter(path, shard_by="cwe", batch_size=4) as writer:
+        for record in records:
+            writer.write(record)
+    assert writer.records == 20
+    for cwe in ("CWE-0", "CWE-1", "CWE-2"):
+        assert read(writer.shard_path(cwe)) == [record for record in records if record["cwe"] == cwe]
+
+
+def test_on_flush_after_the_batch_is_on_disk(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    seen = []
+    writer = ShardedWriter(path, mode="a", batch_size=2)
+    for idx in range(5):
+        writer.write({"idx": idx}, on_flush=lambda idx=idx: seen.append((idx, len(read(path)))))
+    # two full batches; the fifth record still waits in its buffer
+    assert seen == [(0, 2), (1, 2), (2, 4), (3, 4)]
+    writer.close()
+    assert seen[-1] == (4, 5)
+
+
+def test_w_mode_replaces_on_finalize(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    with ShardedWriter(path) as writer:
+        writer.write({"run": 1})
+
+    writer = ShardedWriter(path, batch_size=1)
+    writer.write({"run": 2})
+    # written, but not in place yet
+    assert read(path) == [{"run": 1}]
+    writer.abort()
+    assert read(path) == [{"run": 1}]
+    assert [entry.name for entry in tmp_path.iterdir()] == ["out.jsonl"]
+
+    try:
+        with ShardedWriter(path) as writer:
+            writer.write({"run": 3})
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert read(path) == [{"run": 1}]
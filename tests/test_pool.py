@@ -0,0 +1,46 @@
+import pool as pool_module
+from pairwise import normalize_function_body
+from pool import FunctionPool, load_pool
+from test_similarity import linear_scan, make_data
+
+
+def test_memo_matches_uncached(monkeypatch):
+    data, bases = make_data(3)
+    targets = bases + [entry[3] for entry in data[:5]]
+    pool = FunctionPool(normalize_function_body)
+    for target in targets:
+        assert pool.find(data, target) == linear_scan(data, target)
+
+    # every pair is known now, a second round doesn't compare anything
+    def compared(*args, **kwargs):
+        raise AssertionError("compared again")
+    monkeypatch.setattr(pool_module, "TargetMatcher", compared)
+    for target in targets:
+        assert pool.find(data, target) == linear_scan(data, target)
+
+
+def test_memo_survives_being_cleared():
+    data, bases = make_data(4)
+    pool = FunctionPool(normalize_function_body, max_pairs=50)
+    for _ in range(2):
+        for target in bases:
+            assert pool.find(data, target) == linear_scan(data, target)
+
+
+def test_bodies_are_written_once(tmp_path):
+    path = str(tmp_path / "pool.jsonl")
+    pool = FunctionPool(normalize_function_body, path=path)
+    first = pool.add("int f(void) {  return 0; }")
+    assert pool.add("int f(void) {  return 0; }") == first
+    # ids are for the exact text, not the normalized one
+    second = pool.add("int f(void) { return 0; }")
+    assert second != first
+    pool.close()
+
+    with open(path, 'ab') as file:
+        file.write(b'{"id": "torn')
+    pool = FunctionPool(normalize_function_body, path=path)
+    assert pool.add("int f(void) { return 0; }") == second
+    third = pool.add("int g(void) { return 1; }")
+    pool.close()
+    assert load_pool(path) == {first: "int f(void) {  return 0; }", second: "int f(void) { return 0; }", third: "int g(void) { return 1; }"}
@@ -0,0 +1,54 @@
+import pickle
+from callgraph import CallGraph
+from conftest import write_tree
+from records import FunctionTable
+from split import Chunker
+
+
+def parse(path, compact):
+    return Chunker(compact=compact, verbose=False).read_and_parse_documents_with_callees(str(path))
+
+
+def test_rows_match_tuples(tmp_path):
+    write_tree(str(tmp_path), "records", fix=True)
+    records = parse(tmp_path, compact=False)
+    table = parse(tmp_path, compact=True)
+    assert isinstance(table, FunctionTable)
+    assert len(table) == len(records) == 5
+    assert [tuple(row) for row in table] == records
+    assert table.as_tuples() == records
+    assert table[-1] == records[-1]
+    assert list(table[1:3]) == records[1:3]
+    # helper_0, 1 and 2 are interned once for all their calls
+    assert sorted(table.names.names) == ["helper_0", "helper_1", "helper_2", "parse_header"]
+
+
+def test_table_pickles(tmp_path):
+    write_tree(str(tmp_path), "records")
+    table = parse(tmp_path, compact=True)
+    copy = pickle.loads(pickle.dumps(table))
+    assert copy.as_tuples() == table.as_tuples()
+    copy.append("new.c", "int f(void)", ["helper_0"], "int f(void) { return helper_0(0, 0); }")
+    assert copy.names.ids["helper_0"] == table.names.ids["helper_0"]
+
+
+def test_replace_path_prefix(tmp_path):
+    write_tree(str(tmp_path), "records")
+    table = parse(tmp_path, compact=True)
+    table.replace_path_prefix(str(tmp_path), "/projects/repo")
+    assert {row.file_path for row in table} == {"/projects/repo/src/parser.c", "/projects/repo/src/check.c"}
+
+
+def test_call_graph_reads_table(tmp_path):
+    write_tree(str(tmp_path), "records")
+    records = parse(tmp_path, compact=False)
+    table = parse(tmp_path, compact=True)
+    graph = CallGraph.from_records(table)
+    expected = CallGraph.from_records(records)
+    # the rows themselves, not copies
+    assert graph.records is table
+    assert graph.mapping() == expected.mapping()
+    for name in ("helper_0", "parse_header", "check_len"):
+        assert [tuple(row) for row in graph.caller_records(name)] == expected.caller_records(name)
+        assert graph.callers(name) == expected.callers(name)
+    assert tuple(graph.definition("check_len")) == expected.definition("check_len")
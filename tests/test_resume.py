@@ -0,0 +1,86 @@
+import json
+import os
+import pytest
+import pairwise
+from conftest import parse_header
+from ingest import stream_entries_by_project
+from journal import ProgressJournal, PAIRED, NO_URL, FETCH_FAILED, BENIGN_NOT_FOUND, VULNERABLE_NOT_FOUND
+from store import FunctionStore
+
+
+def read_lines(path):
+    with open(path, 'rb') as file:
+        return file.readlines()
+
+
+def outcomes(path):
+    with open(path) as file:
+        return [json.loads(line)["outcome"] for line in file]
+
+
+def test_full_run(dataset):
+    pairwise.main()
+    lines = read_lines("paired.jsonl")
+    # the two fixes, the other project has no url
+    assert len(lines) == 2
+    paired = json.loads(lines[0])
+    assert paired["vulnerable"]["function"] == paired["benign"]["function"]
+    assert {callee["name"] for callee in paired["vulnerable"]["callees"]} == {"helper_0", "helper_1", "helper_2"}
+    # paired entries are journaled once their batch is on disk, so after the rest
+    assert sorted(outcomes("progress.jsonl")) == sorted([PAIRED, PAIRED, NO_URL])
+
+
+def test_resume_skips_done_entries(dataset):
+    pairwise.main()
+    before = read_lines("paired.jsonl")
+    pairwise.main(resume=True)
+    assert read_lines("paired.jsonl") == before
+
+
+def test_resume_after_interrupt(dataset, tmp_path, monkeypatch):
+    pairwise.main(output_path=str(tmp_path / "reference.jsonl"), journal_path=str(tmp_path / "reference-progress.jsonl"))
+    reference = read_lines(tmp_path / "reference.jsonl")
+
+    process = pairwise.process
+    calls = []
+    def interrupted(*args, **kwargs):
+        calls.append(args)
+        # the second entry's vulnerable parse, after the first is written
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return process(*args, **kwargs)
+    monkeypatch.setattr(pairwise, "process", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        pairwise.main()
+    assert len(read_lines("paired.jsonl")) == 1
+
+    monkeypatch.setattr(pairwise, "process", process)
+    pairwise.main(resume=True)
+    assert read_lines("paired.jsonl") == reference
+    assert not set(outcomes("progress.jsonl")) & {VULNERABLE_NOT_FOUND, BENIGN_NOT_FOUND}
+
+
+def test_failed_checkout_is_not_paired(dataset, remote):
+    # the root commit has no parent to check out, the worktree must not be parsed in its place
+    for split in ("train", "test", "valid"):
+        with open(f"functional/primevul_{split}.jsonl", "w") as file:
+            if split == "train":
+                file.write(json.dumps({"project": "proj", "commit_id": remote["base"], "func": parse_header(), "target": 1}) + "\n")
+    pairwise.main()
+    assert not os.path.exists("paired.jsonl")
+    assert outcomes("progress.jsonl") == [FETCH_FAILED]
+    assert not FunctionStore().has("proj", f"{remote['base']}^")
+
+
+def test_resume_retries_failures(dataset, tmp_path):
+    pairwise.main(output_path=str(tmp_path / "reference.jsonl"), journal_path=str(tmp_path / "reference-progress.jsonl"))
+    reference = read_lines(tmp_path / "reference.jsonl")
+
+    # an earlier run that couldn't fetch anything
+    journal = ProgressJournal("progress.jsonl", resume=False)
+    for entry in stream_entries_by_project(target=1):
+        journal.record(entry, FETCH_FAILED)
+    journal.close()
+
+    pairwise.main(resume=True)
+    assert read_lines("paired.jsonl") == reference
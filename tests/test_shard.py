@@ -0,0 +1,61 @@
+import json
+import os
+import pytest
+import pairwise
+import shard
+from conftest import make_remote, parse_header
+from ingest import project_shard
+from split import Chunker
+from store import FunctionStore
+
+
+def read_lines(path):
+    with open(path, 'rb') as file:
+        return file.readlines()
+
+
+@pytest.fixture
+def two_projects(dataset, tmp_path):
+    # "second" lands in the other shard of two than "proj" does
+    assert project_shard("second", 2) != project_shard("proj", 2)
+    second = make_remote(str(tmp_path), "second")
+    with open("functional/primevul_train.jsonl", "a") as file:
+        file.write(json.dumps({"project": "second", "commit_id": second["fix"], "func": parse_header(), "target": 1}) + "\n")
+    with open("mapping.json") as file:
+        mapping = json.load(file)
+    mapping["second"] = second["url"]
+    with open("mapping.json", "w") as file:
+        json.dump(mapping, file)
+    return second
+
+
+def test_merge_matches_single_run(two_projects, tmp_path):
+    pairwise.main(output_path=str(tmp_path / "reference.jsonl"), journal_path=str(tmp_path / "reference-progress.jsonl"),
+                  store_path=str(tmp_path / "reference.sqlite"))
+    reference = read_lines(tmp_path / "reference.jsonl")
+    assert len(reference) == 3
+
+    for node in range(2):
+        shard.run_node(node, 2)
+    assert shard.merge(2) == len(reference)
+    assert read_lines("paired.jsonl") == reference
+
+
+def test_nodes_have_their_own_store(two_projects, remote):
+    for node in range(2):
+        shard.run_node(node, 2)
+    assert not os.path.exists("functions.sqlite")
+    for project, commit_id in (("proj", remote["fix"]), ("second", two_projects["fix"])):
+        node = project_shard(project, 2)
+        mine = FunctionStore(shard.part_path("functions.sqlite", node, 2))
+        theirs = FunctionStore(shard.part_path("functions.sqlite", 1 - node, 2))
+        assert Chunker(store=mine).stored(project, commit_id)
+        assert not Chunker(store=theirs).stored(project, commit_id)
+        mine.close()
+        theirs.close()
+
+
+def test_merge_needs_every_part(dataset):
+    shard.run_node(0, 2)
+    with pytest.raises(FileNotFoundError):
+        shard.merge(2)
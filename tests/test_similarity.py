@@ -0,0 +1,65 @@
+import random
+from conftest import check_len, parse_header
+from pairwise import check_if_same_function, find_vulnerable_function, normalize_function_body
+from similarity import SimilarityIndex, find_similar
+
+
+def linear_scan(data, target):
+    # what pairwise.find_vulnerable_function did before the index
+    return [entry for entry in data if check_if_same_function(entry[3], target)]
+
+
+def mutate(body, edits, rng):
+    # a few random insertions, deletions and replacements, to land on both sides of 0.9
+    chars = list(body)
+    for _ in range(edits):
+        idx = rng.randrange(len(chars))
+        choice = rng.random()
+        if choice < 0.4:
+            chars.insert(idx, rng.choice("abcxyz(){};+ "))
+        elif choice < 0.7:
+            del chars[idx]
+        else:
+            chars[idx] = rng.choice("abcxyz(){};+ ")
+    return "".join(chars)
+
+
+def make_data(seed=0):
+    rng = random.Random(seed)
+    bases = [parse_header(), parse_header(True), check_len(), check_len(True), "int f(void) { return 0; }"]
+    data = []
+    for idx in range(120):
+        base = rng.choice(bases)
+        body = mutate(base, rng.randrange(0, 60), rng)
+        data.append((f"src/file{idx % 7}.c", body.split("{")[0], [], body))
+    return data, bases
+
+
+def test_index_matches_linear_scan():
+    data, bases = make_data()
+    index = SimilarityIndex(data, normalize_function_body)
+    found = 0
+    for target in bases + [entry[3] for entry in data[:8]]:
+        expected = linear_scan(data, target)
+        assert index.find(target) == expected
+        found += len(expected)
+    # some targets match, and not everything matches everything
+    assert 0 < found < len(data) * 13
+
+
+def test_index_rules_out_most_bodies():
+    data, _ = make_data(1)
+    index = SimilarityIndex(data, normalize_function_body)
+    target = check_len(True)
+    matches = index.find_indices(target)
+    candidates = index.candidates(target)
+    assert set(matches) <= set(candidates)
+    assert len(candidates) < len(data)
+
+
+def test_stream_matches_linear_scan():
+    data, bases = make_data(2)
+    for target in bases:
+        # a generator, like Chunker.iter_records
+        assert list(find_similar(iter(data), target, normalize_function_body)) == linear_scan(data, target)
+        assert find_vulnerable_function(iter(data), target) == linear_scan(data, target)
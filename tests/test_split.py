@@ -0,0 +1,97 @@
+import os
+import pytest
+import records
+from conftest import write_tree
+from split import Chunker
+
+
+def make_tree(path, copies=4):
+    # a few copies of the fixture project, so the pool has files to hand out
+    for idx in range(copies):
+        write_tree(os.path.join(path, f"copy{idx}"), f"copy{idx}", fix=idx % 2 == 0, fix2=idx % 3 == 0)
+    return str(path)
+
+
+def test_pool_matches_serial(tmp_path):
+    repo = make_tree(tmp_path)
+    serial = Chunker(verbose=False).read_and_parse_documents_with_callees(repo)
+    pooled = Chunker(workers=2, verbose=False).read_and_parse_documents_with_callees(repo)
+    assert len(serial) == 20
+    # same functions, in the same order
+    assert pooled == serial
+
+
+def test_iter_records_matches_parse(tmp_path):
+    repo = make_tree(tmp_path, copies=2)
+    parsed = Chunker(verbose=False).read_and_parse_documents_with_callees(repo)
+    records = list(Chunker(verbose=False).iter_records(repo))
+    assert [record.as_tuple() for record in records] == parsed
+    assert all(record.byte_length == len(record.function_body.encode('utf-8')) for record in records)
+
+
+def test_changed_file_is_reported(tmp_path):
+    repo = make_tree(tmp_path, copies=1)
+    record = next(Chunker(verbose=False).iter_records(repo))
+    with open(record.file_path, "a") as file:
+        file.write("\n// changed after the parse\n")
+    # a file that's already mapped isn't checked again
+    records.close_all()
+    with pytest.raises(ValueError):
+        record.function_body
+
+
+# the walk's quirks are what the query engine has to keep: only the outermost calls,
+# pointer and static declarators, methods and nested functions
+SOURCES = {
+    "quirks.c": """static int *lookup(struct table *t, const char *key) {
+    return find(t, hash(key, strlen(key)));
+}
+
+void (*get_handler(int sig))(int) {
+    return handlers[sig];
+}
+
+int main(int argc, char **argv) {
+    if (check(argv[0])) log_error(format("bad %s", argv[0]));
+    while (next(&argc)) step(argc);
+    return run(lookup(NULL, argv[1]) != NULL);
+}
+""",
+    "shape.cpp": """namespace geo {
+class Shape {
+public:
+    int area() const { return width() * height(); }
+    static Shape *make(int w) { return new Shape(scale(w)); }
+};
+}
+int Shape::width() const { return clamp(w_, 0); }
+""",
+    "util.py": """def outer(items):
+    def inner(x):
+        return transform(x)
+    return [inner(item) for item in sorted(items)]
+
+class Cache:
+    def get(self, key):
+        return self.store.get(normalize(key))
+""",
+    "Main.java": """class Main {
+    static int add(int a, int b) { return Math.addExact(a, b); }
+    public static void main(String[] args) { System.out.println(add(parse(args[0]), 2)); }
+}
+""",
+}
+
+
+def test_engines_agree(tmp_path):
+    from compare_engines import compare
+    repo = make_tree(tmp_path / "repo", copies=1)
+    for name, source in SOURCES.items():
+        with open(os.path.join(repo, name), "w") as file:
+            file.write(source)
+    files, skipped, functions, _, _, mismatches = compare(repo, Chunker(engine="walk", verbose=False), Chunker(engine="query", verbose=False))
+    assert files == 2 + len(SOURCES) and skipped == 0
+    # the walk finds no java methods and no python names, the query engine mustn't either
+    assert functions == 5 + 3 + 3 + 2
+    assert mismatches == []
+    assert Chunker(engine="walk", verbose=False).read_and_parse_documents_with_callees(repo) == Chunker(verbose=False).read_and_parse_documents_with_callees(repo)
@@ -0,0 +1,64 @@
+from conftest import write_tree
+from parsers import C_FAMILY
+from records import FunctionTable
+from split import Chunker
+from store import FunctionStore
+
+
+def parse(tmp_path, **state):
+    repo = str(tmp_path / "repo")
+    write_tree(repo, "store", **state)
+    return repo, Chunker(verbose=False).read_and_parse_documents_with_callees(repo)
+
+
+def test_round_trip(tmp_path):
+    _, data = parse(tmp_path)
+    store = FunctionStore(str(tmp_path / "functions.sqlite"))
+    assert not store.has("proj", "base")
+    assert store.load("proj", "base") is None
+
+    store.save("proj", "base", data)
+    assert store.has("proj", "base")
+    assert not store.has("proj", "fix")
+    assert not store.has("other", "base")
+    assert store.load("proj", "base") == data
+    store.close()
+
+    # and from another connection, like a later run
+    store = FunctionStore(str(tmp_path / "functions.sqlite"))
+    assert store.load("proj", "base") == data
+    assert store.functions_named("proj", "base", "check_len") == [entry for entry in data if entry[1].startswith("check_len")]
+    assert store.callers_of("proj", "base", "helper_0") == [entry for entry in data if "helper_0" in entry[2]]
+
+    store.remove("proj", "base")
+    assert not store.has("proj", "base")
+    assert store.functions_named("proj", "base", "check_len") == []
+    store.close()
+
+
+def test_save_replaces(tmp_path):
+    _, data = parse(tmp_path)
+    store = FunctionStore(str(tmp_path / "functions.sqlite"))
+    store.save("proj", "base", data)
+    store.save("proj", "base", data[:2])
+    assert store.load("proj", "base") == data[:2]
+    # the table saves like the tuples it stands for
+    store.save("proj", "table", FunctionTable(data))
+    assert store.load("proj", "table") == data
+    store.close()
+
+
+def test_commit_is_parsed_once(tmp_path, monkeypatch):
+    repo, data = parse(tmp_path)
+    store = FunctionStore(str(tmp_path / "functions.sqlite"))
+    chunker = Chunker(store=store, verbose=False)
+    assert not chunker.stored("proj", "base")
+    assert chunker.read_and_parse_commit(repo, "proj", "base") == data
+    assert chunker.stored("proj", "base")
+
+    # the stored copy, without reading the checkout
+    monkeypatch.setattr(Chunker, "read_and_parse_documents_with_callees", lambda *args, **kwargs: 1 / 0)
+    assert chunker.read_and_parse_commit(repo, "proj", "base") == data
+    # a parse of only some languages is kept apart from the full one
+    assert not Chunker(store=store, languages=C_FAMILY, verbose=False).stored("proj", "base")
+    store.close()